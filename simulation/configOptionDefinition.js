@@ -130,6 +130,13 @@ const configOptionDefinitions = [
     minValue: 1,
     maxValue: Infinity,
   },
+  {
+    name: "dynamicReroutingDetection",
+    type: String,
+    description: `Determines how dynamic rerouting finds the zones within dynamicReroutingDistance. "context" uses SUMO context subscriptions on the polygons around each vehicle, "route" only looks at the zones on the next dynamicReroutingDistance meters of the vehicle's route (no context subscriptions, cost depends on the route length instead of the zone geometries). Defaults to "context".`,
+    required: false,
+    possibleValues: ["context", "route"],
+  },
   {
     name: "snapshotZones",
     type: Boolean,
@@ -142,6 +149,20 @@ const configOptionDefinitions = [
     description: `Determines if a static/dynamic reroute should be triggered when the zones update`,
     required: true,
   },
+  {
+    name: "zoneUpdateRerouteSteps",
+    type: Number,
+    description: `For rerouteOnZoneUpdate: Number of simulation steps over which the vehicles are checked after a zone update. Vehicles that are closest to a zone along their route are checked first. Defaults to 1 (all vehicles are checked in the first step after the update).`,
+    required: false,
+    minValue: 1,
+  },
+  {
+    name: "zoneUpdateRerouteTimeBudget",
+    type: Number,
+    description: `For rerouteOnZoneUpdate: Maximum time (in milliseconds) that is spent per simulation step on checking vehicles after a zone update. The remaining vehicles are checked in the following steps.`,
+    required: false,
+    minValue: 0,
+  },
   {
     name: "nonDepartDecisionMode",
     type: String,
@@ -157,6 +178,85 @@ const configOptionDefinitions = [
     minValue: 0,
     maxValue: 1,
   },
+  {
+    name: "filterNonDepart",
+    type: Boolean,
+    description: `Determines if the vehicles of non-departing people (nonDepartDecisionMode) are removed from the route files before SUMO loads them instead of removing them during the simulation. The filtered route files are written to the output directory. Defaults to false.`,
+    required: false,
+  },
+  {
+    name: "decisionSeed",
+    type: Number,
+    description: `Seed for the depart and rerouting decisions. All decisions are drawn once per person of the demand before the simulation starts, so the same seed always results in the same decisions. Without a seed the decisions are different for every run.`,
+    required: false,
+  },
+  {
+    name: "prefetchZones",
+    type: Boolean,
+    description: `Determines if the zone polygons of the next timestep are read (database query or XML parsing, shape parsing) in a background thread while the current timestep is simulated. Only adding them to SUMO is left for the zone update. Defaults to true.`,
+    required: false,
+  },
+  {
+    name: "router",
+    type: String,
+    description: `Determines which router calculates the routes of rerouted vehicles. "sumo" lets SUMO reroute with adapted travel times, "python" calculates the routes with the Python router in sumo/traci/router.py and sets them in SUMO. Defaults to "sumo".`,
+    required: false,
+    possibleValues: ["sumo", "python"],
+  },
+  {
+    name: "routingProcesses",
+    type: Number,
+    description: `For router "python": Number of worker processes that calculate the routes of all vehicles that are rerouted in the same step. Defaults to 1 (routes are calculated in the simulation process). Ignored on Windows because the worker processes are forked.`,
+    required: false,
+    minValue: 1,
+  },
+  {
+    name: "routeCacheSize",
+    type: Number,
+    description: `Maximum number of routes that are cached per zone timestep. Vehicles with the same current edge, destination edge and avoided zones reuse the cached route instead of calculating it again. The cache is cleared on every zone update. 0 disables the cache. Defaults to 10000.`,
+    required: false,
+    minValue: 0,
+  },
+  {
+    name: "trackingMode",
+    type: String,
+    description: `Determines how vehicles are located inside the zones. "position" checks the vehicle position against the zone polygons, "edge" looks up the current edge of the vehicle in the edges covered by each polygon (faster, but less accurate at zone borders). Defaults to "position".`,
+    required: false,
+    possibleValues: ["position", "edge"],
+  },
+  {
+    name: "trackingOutputFormat",
+    type: String,
+    description: `Determines the file format of the vehicle zone tracking output. "parquet" and "arrow" write columnar files (one row per vehicle and zone per step) and require pyarrow. Defaults to "xml".`,
+    required: false,
+    possibleValues: ["xml", "parquet", "arrow"],
+  },
+  {
+    name: "trackingFlushInterval",
+    type: Number,
+    description: `For trackingOutputFormat = "parquet" or "arrow": Determines after how many simulation steps the buffered tracking records are written to the output file. Defaults to 60.`,
+    required: false,
+    minValue: 1,
+    maxValue: Infinity,
+  },
+  {
+    name: "trackingAggregation",
+    type: Boolean,
+    description: `Determines if the driven distance and time of each vehicle per zone and zone timestep should be aggregated during the simulation. Instead of a record for every step, one summary per vehicle is written to vehicle-zone-summary.xml when the vehicle arrives.`,
+    required: false,
+  },
+  {
+    name: "compressTrackingOutput",
+    type: Boolean,
+    description: `For trackingOutputFormat = "xml": Determines if the vehicle zone tracking output should be gzip-compressed (written to vehicle-zone-tracking.xml.gz)`,
+    required: false,
+  },
+  {
+    name: "compactTrackingOutput",
+    type: Boolean,
+    description: `For trackingOutputFormat = "xml": Determines if the vehicle zone tracking output should be written without indentation (one timestep per line)`,
+    required: false,
+  },
   {
     name: "mesosim",
     type: Boolean,
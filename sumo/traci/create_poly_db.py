@@ -1,4 +1,4 @@
-import sys, os, multiprocessing, time, functools, uuid, glob
+import sys, os, multiprocessing, threading, time, functools, uuid, glob
 from argparse import ArgumentParser
 from lxml import etree
 
@@ -15,6 +15,7 @@ import traci
 import traci.constants as tc
 
 import poly_db
+from polygon_record import parse_shape
 
 parser = ArgumentParser()
 parser.add_argument(
@@ -34,9 +35,48 @@ if db_path is None:
     db_path = os.path.join(base_dir, "airdata", "polygons.sqlite")
 
 
-def process_files(start, files):
-    poly_db.connect(db_path)
+# Polygons are written by a single writer in the main process
+# Set in each worker process by init_worker
+polygon_queue = None
+
+# Number of polygons that are written in one transaction
+polygons_per_transaction = 10000
+
+
+def init_worker(queue):
+    global polygon_queue
+    polygon_queue = queue
+
+
+def write_polygons(queue):
+    # Single writer that receives the polygons of all workers through the queue
+    # This avoids the lock contention of several processes writing to the same SQLite file
+    connection = poly_db.open_connection(db_path)
+    poly_db.begin_bulk_write(connection)
+
+    polygons = []
+    total = 0
+    while True:
+        batch = queue.get()
+        if batch is not None:
+            polygons.extend(batch)
+
+        if len(polygons) >= polygons_per_transaction or (
+            batch is None and len(polygons) > 0
+        ):
+            poly_db.insert_many(polygons, connection)
+            total += len(polygons)
+            polygons = []
 
+        if batch is None:
+            break
+
+    poly_db.end_bulk_write(connection)
+    connection.close()
+    print("Wrote", total, "polygons to", db_path)
+
+
+def process_files(start, files):
     def get_polygons(file_path):
         t = time.time()
         polygons = []
@@ -54,12 +94,7 @@ def process_files(start, files):
 
         for p in polygons:
             pid = p["id"]
-            shape = list(
-                map(
-                    lambda pair: tuple(map(float, pair.split(","))),
-                    p["shape"].split(" "),
-                )
-            )
+            shape = parse_shape(p["shape"]).tolist()
             color = list(map(int, p["color"].split(",")))
             traci.polygon.add(pid, shape, color)
             traci.polygon.subscribeContext(
@@ -72,12 +107,14 @@ def process_files(start, files):
             if polygon_context is not None:
                 edges_in_polygon = list(polygon_context.keys())
 
-            p["edges"] = " ".join(edges_in_polygon)
+            p["edges"] = edges_in_polygon
 
             traci.polygon.remove(pid)
 
-            print(p["id"], len(p["edges"].split(" ")), "edges")
-            poly_db.insert(p)
+            print(p["id"], len(p["edges"]), "edges")
+
+        # Send all polygons of the file to the writer at once
+        polygon_queue.put(polygons)
 
         print(
             "Done", os.path.basename(file_path), f"({format(time.time() - t, '.3f')}s)"
@@ -105,6 +142,7 @@ if __name__ == "__main__":
     poly_db.connect(db_path)
     poly_db.drop_table()
     poly_db.create_table()
+    poly_db.close()
 
     path = base_dir + "/airdata/PM10-idw"
     files = [os.path.join(path, f) for f in os.listdir(path) if f.endswith(".xml")]
@@ -118,8 +156,19 @@ if __name__ == "__main__":
 
     start = time.time()
 
-    pool = multiprocessing.Pool()
+    queue = multiprocessing.Queue()
+    pool = multiprocessing.Pool(initializer=init_worker, initargs=(queue,))
+
+    # Start the writer after the workers have been forked
+    writer = threading.Thread(target=write_polygons, args=(queue,))
+    writer.start()
+
     func = functools.partial(process_files, start)
     pool.map(func, files)
     pool.close()
     pool.join()
+
+    # Tell the writer that all files have been processed
+    queue.put(None)
+    writer.join()
+    print("Total time:", format(time.time() - start, ".3f"), "s")
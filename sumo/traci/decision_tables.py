@@ -0,0 +1,47 @@
+import numpy as np
+from lxml import etree
+
+
+def get_person_id(vid):
+    # Vehicle ids of the demand have the format <person>_<counter>
+    person, separator, counter = vid.rpartition("_")
+    return person if separator else vid
+
+
+def read_person_ids(route_files):
+    # Reads the ids of all people from the vehicles/trips of the route files
+    person_ids = set()
+    for route_file in route_files:
+        for _, elem in etree.iterparse(route_file, tag=("vehicle", "trip")):
+            person_ids.add(get_person_id(elem.get("id")))
+            # Free the memory of the element and of all elements before it
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+    # Sort the ids so that the same seed always results in the same decisions
+    return sorted(person_ids)
+
+
+class DecisionTables:
+    def __init__(self, person_ids, depart_p=1, reroute_p=1, seed=None):
+        # All decisions are drawn at once so that they can be reproduced with the same seed
+        self.person_indices = {pid: i for i, pid in enumerate(person_ids)}
+
+        rng = np.random.default_rng(seed)
+        draws = rng.random((2, len(person_ids)))
+        self.depart = draws[0] < depart_p
+        self.reroute = draws[1] < reroute_p
+
+    def __len__(self):
+        return len(self.person_indices)
+
+    def get_person_index(self, vid):
+        # Returns -1 if the person of the vehicle is not part of the demand
+        return self.person_indices.get(get_person_id(vid), -1)
+
+    def should_depart(self, person_index):
+        return bool(self.depart[person_index])
+
+    def should_reroute(self, person_index):
+        return bool(self.reroute[person_index])
@@ -1,5 +1,4 @@
 import random as rand
-import traci
 
 
 def percent(p=1):
@@ -11,3 +10,24 @@ def percent(p=1):
 
 def random():
     return percent(0.5)
+
+
+def get_probability(sim_config):
+    # Probability that a person departs at all
+    p = 1
+    if "nonDepartDecisionMode" in sim_config:
+        mode = sim_config["nonDepartDecisionMode"]
+        if mode == "percent":
+            if "nonDepartPercent" not in sim_config:
+                raise ValueError(
+                    '"nonDepartDecisionMode: percent" requires the configuration key "nonDepartPercent"'
+                )
+            if sim_config["nonDepartPercent"] < 0 or sim_config["nonDepartPercent"] > 1:
+                raise ValueError(
+                    '"nonDepartPercent" needs to be between 0 and 1 (inclusive)'
+                )
+            p = 1 - sim_config["nonDepartPercent"]
+        if mode == "random":
+            p = 0.5
+
+    return p
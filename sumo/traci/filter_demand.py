@@ -0,0 +1,128 @@
+import os, json
+from argparse import ArgumentParser
+from lxml import etree
+
+from decision_tables import DecisionTables, read_person_ids
+import depart_decisions
+
+
+def get_depart_tables(sim_config, route_files):
+    # Same decisions as the non-depart during the simulation for the same decisionSeed
+    seed = None
+    if "decisionSeed" in sim_config:
+        seed = int(sim_config["decisionSeed"])
+
+    return DecisionTables(
+        read_person_ids(route_files),
+        depart_p=depart_decisions.get_probability(sim_config),
+        seed=seed,
+    )
+
+
+def filter_route_file(route_file, output_file, tables, indent=4):
+    # Streams the route file and only writes the vehicles/trips of people that depart
+    # All other elements (vehicle types, routes, ...) are copied as they are
+    kept = 0
+    removed = 0
+
+    with open(output_file, "wb") as f:
+        f.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+        with etree.xmlfile(f, encoding="utf-8") as xf:
+            context = etree.iterparse(route_file, events=("start", "end"))
+            _, root = next(context)
+
+            with xf.element(root.tag, dict(root.attrib), nsmap=root.nsmap):
+                depth = 1
+                for event, elem in context:
+                    if event == "start":
+                        depth += 1
+                        continue
+
+                    depth -= 1
+                    if depth != 1:
+                        continue
+
+                    # Element is a direct child of the root
+                    write = True
+                    if elem.tag in ("vehicle", "trip"):
+                        person_index = tables.get_person_index(elem.get("id"))
+                        if person_index != -1 and not tables.should_depart(
+                            person_index
+                        ):
+                            write = False
+
+                        if write:
+                            kept += 1
+                        else:
+                            removed += 1
+
+                    if write:
+                        elem.tail = None
+                        xf.write("\n" + " " * indent)
+                        xf.write(elem)
+
+                    # Free the memory of all elements that have already been written
+                    root.clear()
+
+                xf.write("\n")
+
+    return kept, removed
+
+
+def get_output_file(route_file, output_dir):
+    name = os.path.basename(route_file)
+    if name.endswith(".rou.xml"):
+        name = name[: -len(".rou.xml")]
+
+    return os.path.join(output_dir, f"{name}.filtered.rou.xml")
+
+
+def filter_non_depart(sim_config, route_files, output_dir, log=print):
+    # Returns the paths of the filtered route files
+    tables = get_depart_tables(sim_config, route_files)
+
+    output_files = []
+    for route_file in route_files:
+        output_file = get_output_file(route_file, output_dir)
+        kept, removed = filter_route_file(route_file, output_file, tables)
+        log(
+            f"Removed {removed} of {kept + removed} vehicles due to non-depart from {os.path.basename(route_file)}"
+        )
+        output_files.append(output_file)
+
+    return output_files
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--config",
+        dest="config",
+        help="Filepath to the simulation config file",
+        metavar="FILE",
+        type=str,
+    )
+    parser.add_argument(
+        "--routes",
+        dest="routes",
+        help="Filepath(s) to the route files (comma-separated)",
+        metavar="FILE",
+        type=str,
+    )
+    parser.add_argument(
+        "--output-dir",
+        "-o",
+        dest="output_dir",
+        help="Directory for the filtered route files",
+        metavar="FILE",
+        type=str,
+    )
+
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        sim_config = json.load(config_file)
+
+    route_files = args.routes.split(",")
+    output_dir = args.output_dir or os.path.dirname(os.path.abspath(route_files[0]))
+    filter_non_depart(sim_config, route_files, output_dir)
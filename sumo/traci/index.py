@@ -1,5 +1,6 @@
 import os, sys, getopt, json, math, re
 from argparse import ArgumentParser
+from lxml import etree
 
 from logger import open_log, log
 import poly_db
@@ -75,10 +76,21 @@ if args.db:
         raise ValueError(error)
 
     poly_db.connect(db_path)
+    if poly_db.needs_migration():
+        log(f"Migrating polygon database {db_path} to version {poly_db.schema_version}")
+        poly_db.migrate()
 
 # Add some additional data to simulation config dictionary
 sim_config["sim_airDataDir"] = sim_airdata_dir
 sim_config["sim_polygonDatabase"] = args.db
+sim_config["sim_gui"] = args.gui
+
+# Get the network and route files from the SUMO config
+sumo_config = etree.parse(args.sumo_config)
+sim_config["sim_networkFile"] = sumo_config.find("input/net-file").get("value")
+sim_config["sim_routeFiles"] = (
+    sumo_config.find("input/route-files").get("value").split(",")
+)
 sim_config["sim_outputDir"] = sim_output_dir
 
 # Make sure dynamicReroutingDistance is a float
@@ -97,12 +109,44 @@ if "mesosim" in sim_config and sim_config["mesosim"]:
 else:
     log("Using microscopic simulation model")
 
+if "trackingMode" in sim_config and sim_config["trackingMode"] == "edge":
+    log("Using edge-based vehicle tracking")
+else:
+    log("Using position-based vehicle tracking")
+
+if "router" in sim_config and sim_config["router"] == "python":
+    log("Using Python router for rerouting")
+else:
+    log("Using SUMO router for rerouting")
+
+if sim_config["zoneRerouting"] == "dynamic":
+    if (
+        "dynamicReroutingDetection" in sim_config
+        and sim_config["dynamicReroutingDetection"] == "route"
+    ):
+        log("Using route lookahead for dynamic rerouting")
+    else:
+        log("Using polygon context subscriptions for dynamic rerouting")
+
 if "libsumo" in sim_config and sim_config["libsumo"]:
     log("Using libsumo")
     os.environ["LIBSUMO_AS_TRACI"] = "pleaseuselibsumokthxbye"
 else:
     log("Using TraCI")
 
+if "filterNonDepart" in sim_config and sim_config["filterNonDepart"]:
+    import depart_decisions
+    from filter_demand import filter_non_depart
+
+    if depart_decisions.get_probability(sim_config) < 1:
+        # Remove the vehicles of non-departing people before SUMO loads them
+        log("Using offline non-depart filtering of the demand")
+        route_files = filter_non_depart(
+            sim_config, sim_config["sim_routeFiles"], sim_output_dir, log=log
+        )
+        sumo_cmd.extend(["--route-files", ",".join(route_files)])
+        sim_config["sim_demandFiltered"] = True
+
 log()
 
 from simulation_controller import SimulationController
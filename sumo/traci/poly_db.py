@@ -1,18 +1,35 @@
 import os, glob, re
 import sqlite3
+from argparse import ArgumentParser
+import numpy as np
+
+from polygon_record import get_polygon_kind, parse_shape, parse_timestep
+
+# Version 1: single polygons table with TEXT timesteps and space-joined edges
+# Version 2: indexed integer timesteps and a separate table for the edges of each polygon
+# Version 3: shapes as packed float64 coordinates with bounding box columns
+schema_version = 3
 
 attributes = [
+    {"name": "idx", "type": "INTEGER PRIMARY KEY"},
     {"name": "id", "type": "TEXT",},
     {"name": "zone", "type": "INTEGER"},
-    {"name": "timestep", "type": "TEXT"},
+    {"name": "kind", "type": "INTEGER"},
+    # Seconds since midnight
+    {"name": "timestep", "type": "INTEGER"},
     {"name": "type", "type": "TEXT"},
     {"name": "color", "type": "TEXT"},
     {"name": "layer", "type": "INTEGER"},
-    {"name": "shape", "type": "TEXT"},
-    {"name": "edges", "type": "TEXT"},
+    # Little-endian float64 coordinates (x0, y0, x1, y1, ...)
+    {"name": "shape", "type": "BLOB"},
+    {"name": "minx", "type": "REAL"},
+    {"name": "miny", "type": "REAL"},
+    {"name": "maxx", "type": "REAL"},
+    {"name": "maxy", "type": "REAL"},
 ]
 
 db = None
+db_path = None
 
 
 def dict_factory(cursor, row):
@@ -31,35 +48,154 @@ def find_db(directory):
 
 
 def connect(path):
-    global db
-    db = sqlite3.connect(path, 30)
-    db.row_factory = dict_factory
+    global db, db_path
+    db_path = path
+    db = open_connection(path)
+
+
+def open_connection(path=None):
+    # Opens another connection to the database (e.g. for a different thread)
+    connection = sqlite3.connect(path or db_path, 30)
+    connection.row_factory = dict_factory
+    return connection
 
 
 def close():
     db.close()
 
 
-def execute(sql):
-    cursor = db.execute(sql)
+def execute(sql, parameters=()):
+    cursor = db.execute(sql, parameters)
     db.commit()
     return cursor
 
 
-def create_table():
+def pack_shape(shape):
+    # The shape can be given as SUMO shape string or as coordinates
+    if isinstance(shape, str):
+        shape = parse_shape(shape)
+
+    coordinates = np.asarray(shape, dtype="<f8").reshape(-1, 2)
+    return coordinates.tobytes(), coordinates.min(axis=0), coordinates.max(axis=0)
+
+
+def unpack_shape(blob):
+    # Returns the coordinates (n x 2) without copying the data
+    return np.frombuffer(blob, dtype="<f8").reshape(-1, 2)
+
+
+def begin_bulk_write(connection=None):
+    # Faster settings while the database is built by a single writer
+    # WAL lets readers continue while writing and NORMAL only syncs at checkpoints
+    connection = connection or db
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+
+
+def end_bulk_write(connection=None):
+    # Move everything from the WAL back into the database file so that it can be copied on its own
+    connection = connection or db
+    connection.execute("PRAGMA journal_mode=DELETE")
+    connection.execute("PRAGMA synchronous=FULL")
+
+
+def create_tables(connection):
     table_string = ", ".join(
         list(map(lambda attrib: f"{attrib['name']} {attrib['type']}", attributes))
     )
-    execute(f"CREATE TABLE IF NOT EXISTS polygons ({table_string})")
+    connection.execute(f"CREATE TABLE IF NOT EXISTS polygons ({table_string})")
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS polygons_timestep ON polygons (timestep)"
+    )
+    # Dictionary of all edge ids so that they are only stored once
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS edges (idx INTEGER PRIMARY KEY, id TEXT UNIQUE)"
+    )
+    # The edges of a polygon are stored next to each other
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS polygon_edges ("
+        "polygon_id INTEGER, edge_idx INTEGER, PRIMARY KEY (polygon_id, edge_idx)"
+        ") WITHOUT ROWID"
+    )
+    connection.execute(f"PRAGMA user_version = {schema_version}")
+
+
+def create_table():
+    create_tables(db)
+    db.commit()
 
 
 def drop_table():
     execute("DROP TABLE IF EXISTS polygons")
+    execute("DROP TABLE IF EXISTS edges")
+    execute("DROP TABLE IF EXISTS polygon_edges")
+
+
+def write_polygons(polygons, connection):
+    # Writes the polygons (dicts with the edge ids as list) without committing
+    # The timestep can be given as HH-MM-SS or in seconds
+    # and the shape as SUMO shape string or as coordinates
+    edge_ids = set()
+    for p in polygons:
+        edge_ids.update(p["edges"])
+
+    connection.executemany(
+        "INSERT OR IGNORE INTO edges (id) VALUES (?)", ((eid,) for eid in edge_ids)
+    )
+    edge_indices = {}
+    for row in connection.execute("SELECT idx, id FROM edges"):
+        edge_indices[row["id"]] = row["idx"]
+
+    # Assign the polygon indices here so that the edges can reference them
+    start = connection.execute("SELECT COALESCE(MAX(idx), 0) AS n FROM polygons")
+    start = start.fetchone()["n"] + 1
+
+    polygon_rows = []
+    edge_rows = []
+    for i, p in enumerate(polygons):
+        idx = start + i
+        timestep = p["timestep"]
+        if isinstance(timestep, str):
+            timestep = parse_timestep(timestep)
+
+        shape, (minx, miny), (maxx, maxy) = pack_shape(p["shape"])
+        polygon_rows.append(
+            (
+                idx,
+                p["id"],
+                p["zone"],
+                int(get_polygon_kind(p["id"], p["type"])),
+                timestep,
+                p["type"],
+                p["color"],
+                p["layer"],
+                shape,
+                float(minx),
+                float(miny),
+                float(maxx),
+                float(maxy),
+            )
+        )
+        edge_rows.extend((idx, edge_indices[eid]) for eid in set(p["edges"]))
+
+    placeholders = ", ".join(["?"] * len(attributes))
+    connection.executemany(
+        f"INSERT INTO polygons VALUES ({placeholders})", polygon_rows
+    )
+    connection.executemany(
+        "INSERT INTO polygon_edges (polygon_id, edge_idx) VALUES (?, ?)", edge_rows
+    )
 
 
 def insert(polygon):
-    values = [f"'{polygon[attrib['name']]}'" for attrib in attributes]
-    execute(f"INSERT INTO polygons VALUES ({', '.join(values)})")
+    insert_many([polygon])
+
+
+def insert_many(polygons, connection=None):
+    # Inserts all polygons in a single transaction
+    connection = connection or db
+    with connection:
+        write_polygons(polygons, connection)
 
 
 def get_all():
@@ -68,8 +204,176 @@ def get_all():
     return polygons
 
 
-def get_all_from_timestep(timestep):
-    cursor = execute(f"SELECT * FROM polygons WHERE timestep='{timestep}'")
-    polygons = cursor.fetchall()
+def get_edge_ids(connection=None):
+    # Array of all edge ids by their index in the edges table
+    connection = connection or db
+    cursor = connection.cursor()
+    cursor.row_factory = None
+    rows = cursor.execute("SELECT idx, id FROM edges").fetchall()
+
+    edge_ids = np.empty(max((idx for idx, _ in rows), default=0) + 1, dtype=object)
+    for idx, eid in rows:
+        edge_ids[idx] = eid
+
+    return edge_ids
+
+
+def get_all_from_timestep(timestep, connection=None):
+    # Index range scan over the polygons of the timestep
+    # The edges of each polygon are returned as an array of edge indices (see get_edge_ids)
+    connection = connection or db
+    if isinstance(timestep, str):
+        timestep = parse_timestep(timestep)
+
+    polygons = connection.execute(
+        "SELECT * FROM polygons WHERE timestep=? ORDER BY idx", (timestep,)
+    ).fetchall()
+
+    cursor = connection.cursor()
+    cursor.row_factory = None
+    edge_rows = cursor.execute(
+        "SELECT polygon_id, edge_idx FROM polygon_edges WHERE polygon_id IN "
+        "(SELECT idx FROM polygons WHERE timestep=?) ORDER BY polygon_id",
+        (timestep,),
+    ).fetchall()
+
+    # Split the edge indices into one array per polygon
+    edges = {}
+    if len(edge_rows) > 0:
+        edge_rows = np.array(edge_rows, dtype=np.int64)
+        polygon_ids = edge_rows[:, 0]
+        starts = np.flatnonzero(np.diff(polygon_ids)) + 1
+        for pid, indices in zip(
+            polygon_ids[np.r_[0, starts]], np.split(edge_rows[:, 1], starts)
+        ):
+            edges[int(pid)] = indices.astype(np.int32)
+
+    empty = np.empty(0, dtype=np.int32)
+    for p in polygons:
+        p["edges"] = edges.get(p["idx"], empty)
+
     return polygons
 
+
+def get_schema_version(connection=None):
+    connection = connection or db
+    version = connection.execute("PRAGMA user_version").fetchone()["user_version"]
+    if version == 0:
+        # Databases of the first version don't set the user version
+        table = connection.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name='polygons'"
+        ).fetchone()
+        return 1 if table is not None else schema_version
+
+    return version
+
+
+def needs_migration(connection=None):
+    return get_schema_version(connection) < schema_version
+
+
+def migrate_v1(connection, batch_size):
+    # Space-joined edges and TEXT timesteps and shapes
+    connection.execute("ALTER TABLE polygons RENAME TO polygons_v1")
+    create_tables(connection)
+
+    # Insert the polygons ordered by timestep so that each timestep is stored together
+    old_rows = connection.cursor()
+    old_rows.execute("SELECT * FROM polygons_v1 ORDER BY timestep, rowid")
+    while True:
+        rows = old_rows.fetchmany(batch_size)
+        if len(rows) == 0:
+            break
+
+        for row in rows:
+            row["edges"] = row["edges"].split(" ") if row["edges"] != "" else []
+        write_polygons(rows, connection)
+
+    connection.execute("DROP TABLE polygons_v1")
+
+
+def migrate_v2(connection, batch_size):
+    # TEXT shapes without bounding boxes
+    # The polygon indices are kept so that the edges table stays valid
+    connection.execute("DROP INDEX IF EXISTS polygons_timestep")
+    connection.execute("ALTER TABLE polygons RENAME TO polygons_v2")
+    create_tables(connection)
+
+    placeholders = ", ".join(["?"] * len(attributes))
+    old_rows = connection.cursor()
+    old_rows.execute("SELECT * FROM polygons_v2 ORDER BY idx")
+    while True:
+        rows = old_rows.fetchmany(batch_size)
+        if len(rows) == 0:
+            break
+
+        polygon_rows = []
+        for row in rows:
+            shape, (minx, miny), (maxx, maxy) = pack_shape(row["shape"])
+            polygon_rows.append(
+                (
+                    row["idx"],
+                    row["id"],
+                    row["zone"],
+                    row["kind"],
+                    row["timestep"],
+                    row["type"],
+                    row["color"],
+                    row["layer"],
+                    shape,
+                    float(minx),
+                    float(miny),
+                    float(maxx),
+                    float(maxy),
+                )
+            )
+        connection.executemany(
+            f"INSERT INTO polygons VALUES ({placeholders})", polygon_rows
+        )
+
+    connection.execute("DROP TABLE polygons_v2")
+
+
+def migrate(connection=None, batch_size=10000):
+    # Converts a database of an older version to the current schema in one transaction
+    connection = connection or db
+    version = get_schema_version(connection)
+    if version >= schema_version:
+        return
+
+    connection.execute("BEGIN")
+    try:
+        if version == 1:
+            # Writes the current schema directly
+            migrate_v1(connection, batch_size)
+        else:
+            migrate_v2(connection, batch_size)
+
+        connection.commit()
+    except:
+        connection.rollback()
+        raise
+
+    # Free the space of the old table
+    connection.execute("VACUUM")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument(
+        "--db",
+        dest="db",
+        help="Filepath to the polygon database that should be migrated to the current schema",
+        metavar="FILE",
+        type=str,
+    )
+
+    args = parser.parse_args()
+    connect(args.db)
+    version = get_schema_version()
+    if version < schema_version:
+        print(f"Migrating {args.db} from version {version} to {schema_version}")
+        migrate()
+    else:
+        print(f"{args.db} already uses version {version}")
+    close()
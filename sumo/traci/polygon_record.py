@@ -0,0 +1,64 @@
+import sys
+from enum import IntEnum
+import numpy as np
+
+
+class PolygonKind(IntEnum):
+    ZONE = 0
+    FILLED_HOLE = 1  # Hole that is just another nested zone
+    EMPTY_HOLE = 2  # Hole that is not part of any zone (zone 0)
+
+
+def get_polygon_kind(pid, ptype):
+    if not pid.startswith("hole"):
+        return PolygonKind.ZONE
+
+    return PolygonKind.EMPTY_HOLE if ptype == "empty-hole" else PolygonKind.FILLED_HOLE
+
+
+def parse_shape(shape):
+    # Parses a SUMO shape ("x,y x,y ...") into an array of coordinates (n x 2)
+    # The floats are parsed by numpy instead of for every coordinate in Python
+    return np.array(shape.replace(",", " ").split(), dtype=float).reshape(-1, 2)
+
+
+def parse_timestep(timestep):
+    # Converts a zone timestep (HH-MM-SS) to seconds
+    hours, minutes, seconds = map(int, timestep.split("-"))
+    return hours * 60 * 60 + minutes * 60 + seconds
+
+
+class PolygonRecord:
+    # Compact record of a zone polygon
+    # timestep is the zone timestep in seconds, which is cheaper to compare than the string
+    __slots__ = (
+        "id",
+        "zone",
+        "zone_timestep",
+        "timestep",
+        "kind",
+        "type",
+        "shape",
+        "geometry_hash",
+        "edges",
+    )
+
+    def __init__(
+        self, pid, zone, zone_timestep, ptype, shape, geometry_hash, edges=None
+    ):
+        # Strings that are shared by many polygons or used as keys are interned
+        self.id = sys.intern(pid)
+        self.zone = zone
+        self.zone_timestep = sys.intern(zone_timestep)
+        self.timestep = parse_timestep(zone_timestep)
+        self.kind = get_polygon_kind(pid, ptype)
+        self.type = sys.intern(ptype)
+        self.shape = shape
+        self.geometry_hash = geometry_hash
+        # Edges are None until they have been looked up
+        self.edges = None
+        if edges is not None:
+            self.set_edges(edges)
+
+    def set_edges(self, edges):
+        self.edges = frozenset(sys.intern(eid) for eid in edges)
@@ -1,5 +1,4 @@
 import random as rand
-import traci
 
 
 def percent(p=1):
@@ -11,3 +10,24 @@ def percent(p=1):
 
 def random():
     return percent(0.5)
+
+
+def get_probability(sim_config):
+    # Probability that a person decides to reroute
+    p = 1
+    if "reroutingDecisionMode" in sim_config:
+        mode = sim_config["reroutingDecisionMode"]
+        if mode == "percent":
+            if "reroutingPercent" not in sim_config:
+                raise ValueError(
+                    '"reroutingDecisionMode: percent" requires the configuration key "reroutingPercent"'
+                )
+            if sim_config["reroutingPercent"] < 0 or sim_config["reroutingPercent"] > 1:
+                raise ValueError(
+                    '"reroutingPercent" needs to be between 0 and 1 (inclusive)'
+                )
+            p = sim_config["reroutingPercent"]
+        if mode == "random":
+            p = 0.5
+
+    return p
@@ -0,0 +1,69 @@
+import sys
+from collections import OrderedDict
+
+
+class RouteCache:
+    def __init__(self, capacity=10000):
+        # Least recently used cache of routes by (from edge, to edge, zone timestep, avoided polygons)
+        self.capacity = capacity
+        self.routes = OrderedDict()
+        self.size = 0  # Approximate memory of all cached routes in bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.routes)
+
+    def __contains__(self, key):
+        return key in self.routes
+
+    def __route_size(self, route):
+        return sys.getsizeof(route) + sum(sys.getsizeof(eid) for eid in route)
+
+    def get(self, key):
+        # Returns None if the route is not cached
+        if key not in self.routes:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.routes.move_to_end(key)
+        return self.routes[key]
+
+    def put(self, key, route):
+        if self.capacity <= 0:
+            return
+
+        if key in self.routes:
+            self.size -= self.__route_size(self.routes.pop(key))
+
+        self.routes[key] = route
+        self.size += self.__route_size(route)
+
+        while len(self.routes) > self.capacity:
+            _, evicted = self.routes.popitem(last=False)
+            self.size -= self.__route_size(evicted)
+            self.evictions += 1
+
+    def clear(self):
+        self.routes = OrderedDict()
+        self.size = 0
+
+    def get_stats(self):
+        # Returns the statistics since the last call
+        lookups = self.hits + self.misses
+        stats = {
+            "lookups": lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self.routes),
+            "memory": self.size,
+        }
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        return stats
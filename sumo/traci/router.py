@@ -0,0 +1,211 @@
+import heapq, math, multiprocessing
+import numpy as np
+import sumolib
+
+
+class Router:
+    def __init__(self, net_file, vclass="passenger"):
+        # Load the network as an edge graph in compressed sparse row (CSR) format
+        # Node i of the graph is edge i of the network, successors are the outgoing edges
+        net = sumolib.net.readNet(net_file)
+        edges = [e for e in net.getEdges() if e.allows(vclass)]
+
+        self.edge_ids = [e.getID() for e in edges]
+        self.edge_indices = {eid: i for i, eid in enumerate(self.edge_ids)}
+
+        n = len(edges)
+        self.lengths = np.array([e.getLength() for e in edges], dtype=float)
+        self.speeds = np.array([e.getSpeed() for e in edges], dtype=float)
+        self.ends = np.array(
+            [e.getToNode().getCoord()[:2] for e in edges], dtype=float
+        ).reshape(-1, 2)
+
+        self.offsets = np.zeros(n + 1, dtype=np.int32)
+        successors = []
+        for i, e in enumerate(edges):
+            for succ in e.getOutgoing():
+                if succ.getID() in self.edge_indices:
+                    successors.append(self.edge_indices[succ.getID()])
+            self.offsets[i + 1] = len(successors)
+        self.successors = np.array(successors, dtype=np.int32)
+
+        # Free-flow travel times are used for all edges without penalty
+        self.base_weights = self.lengths / self.speeds
+        # Lower bound of the travel time on each edge for the A* heuristic
+        self.max_speed = float(self.speeds.max()) if n > 0 else 1.0
+        self.min_weights = self.lengths / self.max_speed
+
+        # Plain lists are a lot faster than NumPy arrays for element-wise access in the search loop
+        self.__offsets = self.offsets.tolist()
+        self.__successors = self.successors.tolist()
+        self.__end_x = self.ends[:, 0].tolist()
+        self.__end_y = self.ends[:, 1].tolist()
+
+    def get_weights(self, penalties):
+        # Combine the free-flow travel times with the zone penalties (edge id -> travel time)
+        # Penalties replace the travel time of an edge like SUMO's adapted travel times
+        weights = self.base_weights.copy()
+        for eid, t in penalties.items():
+            if eid in self.edge_indices:
+                weights[self.edge_indices[eid]] = t
+
+        return {
+            "values": weights.tolist(),
+            # The A* heuristic is only admissible if no edge is faster than its lower bound
+            "admissible": bool(np.all(weights >= self.min_weights)),
+        }
+
+    def route(self, from_edge, to_edge, weights):
+        # Returns the fastest route from from_edge to to_edge as list of edge ids
+        # or None if there is no such route
+        if from_edge not in self.edge_indices or to_edge not in self.edge_indices:
+            return None
+
+        source = self.edge_indices[from_edge]
+        target = self.edge_indices[to_edge]
+        if source == target:
+            return [from_edge]
+
+        values = weights["values"]
+        offsets = self.__offsets
+        successors = self.__successors
+        end_x = self.__end_x
+        end_y = self.__end_y
+        target_x = end_x[target]
+        target_y = end_y[target]
+        max_speed = self.max_speed
+
+        if weights["admissible"]:
+            # A* with the straight-line distance at maximum network speed
+            heuristic = lambda i: (
+                math.hypot(end_x[i] - target_x, end_y[i] - target_y) / max_speed
+            )
+        else:
+            # Dijkstra
+            heuristic = lambda i: 0
+
+        costs = {source: 0.0}
+        previous = {source: -1}
+        visited = set()
+        queue = [(heuristic(source), 0.0, source)]
+        while len(queue) > 0:
+            _, cost, i = heapq.heappop(queue)
+            if i == target:
+                break
+
+            if i in visited:
+                continue
+            visited.add(i)
+
+            for k in range(offsets[i], offsets[i + 1]):
+                j = successors[k]
+                new_cost = cost + values[j]
+                if j not in costs or new_cost < costs[j]:
+                    costs[j] = new_cost
+                    previous[j] = i
+                    heapq.heappush(queue, (new_cost + heuristic(j), new_cost, j))
+        else:
+            return None
+
+        route = []
+        i = target
+        while i != -1:
+            route.append(self.edge_ids[i])
+            i = previous[i]
+
+        return route[::-1]
+
+
+def is_pool_supported():
+    # The worker processes of the RouterPool are forked, which is not possible on Windows
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+def run_worker(connection, router):
+    # The router of the parent process is inherited when the worker is forked
+    # Every worker keeps the edge weights of all route keys that are still in use
+    weights = {}
+
+    while True:
+        message, data = connection.recv()
+        if message == "weights":
+            for key, penalties in data.items():
+                weights[key] = router.get_weights(penalties)
+        elif message == "retain":
+            weights = {key: w for key, w in weights.items() if key in data}
+        elif message == "route":
+            connection.send(
+                [
+                    router.route(from_edge, to_edge, weights[key])
+                    for from_edge, to_edge, key in data
+                ]
+            )
+        else:
+            break
+
+    connection.close()
+
+
+class RouterPool:
+    def __init__(self, router, processes):
+        # Worker processes are forked so that they don't run the simulation script again
+        # and share the already loaded network of the router instead of reading it again
+        context = multiprocessing.get_context("fork")
+        self.processes = processes
+        # Route keys whose penalties have already been sent to all workers
+        self.sent_keys = set()
+
+        self.connections = []
+        self.workers = []
+        for _ in range(processes):
+            connection, worker_connection = context.Pipe()
+            worker = context.Process(
+                target=run_worker, args=(worker_connection, router), daemon=True,
+            )
+            worker.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.workers.append(worker)
+
+    def route_all(self, requests, penalties):
+        # requests is a list of (from edge, to edge, key of the penalties)
+        # penalties maps each key to the zone penalties (edge id -> travel time)
+        # Returns the routes in the same order as the requests
+        if len(requests) == 0:
+            return []
+
+        # The penalties of a key are only sent once, afterwards the workers get just the keys
+        new_keys = set(key for _, _, key in requests) - self.sent_keys
+        if len(new_keys) > 0:
+            new_penalties = {key: penalties[key] for key in new_keys}
+            for connection in self.connections:
+                connection.send(("weights", new_penalties))
+            self.sent_keys.update(new_keys)
+
+        # One chunk of requests per worker
+        chunk_size = math.ceil(len(requests) / self.processes)
+        chunks = [
+            requests[i : i + chunk_size] for i in range(0, len(requests), chunk_size)
+        ]
+        for connection, chunk in zip(self.connections, chunks):
+            connection.send(("route", chunk))
+
+        routes = []
+        for connection, _ in zip(self.connections, chunks):
+            routes.extend(connection.recv())
+
+        return routes
+
+    def retain(self, keys):
+        # Workers forget the edge weights of all other keys (e.g. after a zone update)
+        self.sent_keys = self.sent_keys.intersection(keys)
+        for connection in self.connections:
+            connection.send(("retain", self.sent_keys))
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(("close", None))
+            connection.close()
+
+        for worker in self.workers:
+            worker.join()
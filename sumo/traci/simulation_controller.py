@@ -7,6 +7,8 @@ import psutil
 from tracker import Tracker
 from vehicle_controller import VehicleController
 from zone_controller import ZoneController
+from vehicle_state import VehicleStates
+from step_snapshot import StepSnapshot
 from logger import log
 
 
@@ -17,8 +19,12 @@ class SimulationController:
 
         self.sim_config = sim_config
         self.zone_controller = ZoneController(sim_config)
-        self.tracker = Tracker(sim_config, self.zone_controller)
-        self.vehicle_controller = VehicleController(sim_config, self.zone_controller)
+        # Vehicle parameters are only written to SUMO when they can be inspected in the GUI
+        self.vehicle_states = VehicleStates(sync_parameters=sim_config["sim_gui"])
+        self.tracker = Tracker(sim_config, self.zone_controller, self.vehicle_states)
+        self.vehicle_controller = VehicleController(
+            sim_config, self.zone_controller, self.vehicle_states
+        )
 
         self.process = psutil.Process()
 
@@ -42,7 +48,7 @@ class SimulationController:
 
             # Prepare initial vehicles
             x = time.time()
-            self.vehicle_controller.prepare_new_vehicles()
+            self.vehicle_controller.prepare_new_vehicles(StepSnapshot(0))
             prep_time += time.time() - x
 
             # Run the simulation
@@ -54,14 +60,17 @@ class SimulationController:
                 step_time += time.time() - x
                 # log(f"After step {step}")
 
+                # Collect everything the controllers need from this step at once
                 x = time.time()
-                self.vehicle_controller.prepare_new_vehicles()
-                self.vehicle_controller.clean_up_vehicles()
+                snapshot = StepSnapshot(step)
+                self.vehicle_controller.prepare_new_vehicles(snapshot)
+                self.vehicle_controller.clean_up_vehicles(snapshot)
+                snapshot.collect_vehicles()
                 prep_time += time.time() - x
                 # log(f"After new vehicle prep")
 
                 x = time.time()
-                self.tracker.track_vehicles_in_polygons(step)
+                self.tracker.track_vehicles_in_polygons(snapshot)
                 tracking_time += time.time() - x
                 # log(f"After tracking")
 
@@ -80,6 +89,18 @@ class SimulationController:
                     log(f"Vehicle rerouting time: {format(rerouting_time, '.3f')}s")
                     log()
 
+                    route_cache = self.vehicle_controller.route_cache
+                    if route_cache.capacity > 0:
+                        stats = route_cache.get_stats()
+                        log(
+                            f"Route cache lookups: {stats['lookups']} (hit rate: {format(stats['hit_rate'] * 100, '.1f')} %)"
+                        )
+                        log(f"Route cache evictions: {stats['evictions']}")
+                        log(
+                            f"Route cache memory: {stats['entries']} routes, {format(stats['memory'] / 1024 / 1024, '.3f')} MB"
+                        )
+                        log()
+
                     timestep_time = time.time()
                     step_time = 0
                     prep_time = 0
@@ -103,7 +124,7 @@ class SimulationController:
 
                 if self.sim_config["zoneRerouting"] != "none":
                     x = time.time()
-                    self.vehicle_controller.reroute()
+                    self.vehicle_controller.reroute(snapshot)
                     rerouting_time += time.time() - x
                     # log(f"After reroute")
 
@@ -118,8 +139,10 @@ class SimulationController:
             log()
             log(f"Finished at step {step}")
             log(f"Total simulation time: {format(time.time() - total_time, '.3f')}s")
-            self.__finish()
+            self.__finish(step)
 
-    def __finish(self):
-        self.tracker.finish()
+    def __finish(self, step):
+        self.tracker.finish(step)
+        self.vehicle_controller.finish()
+        self.zone_controller.finish()
         traci.close()
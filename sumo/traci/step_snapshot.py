@@ -0,0 +1,45 @@
+import numpy as np
+import traci
+import traci.constants as tc
+
+
+class StepSnapshot:
+    def __init__(self, step):
+        # Everything the controllers need from SUMO for one simulation step
+        # Each value is only requested once per step
+        self.step = step
+        self.time = traci.simulation.getTime()
+        self.loaded = traci.simulation.getLoadedIDList()
+        self.departed = traci.simulation.getDepartedIDList()
+        self.arrived = traci.simulation.getArrivedIDList()
+
+        self.vehicle_vars = {}
+        self.vehicle_subs = {}
+        self.vehicle_ids = []
+        self.rows = {}
+        self.positions = np.zeros((0, 2), dtype=float)
+        self.speeds = np.zeros(0, dtype=float)
+        self.route_indices = np.zeros(0, dtype=np.int32)
+        self.current_edges = []
+
+    def collect_vehicles(self):
+        # Has to be called after the new vehicles have been subscribed
+        # so that their variables are part of the subscription results
+        self.vehicle_vars = traci.vehicle.getAllSubscriptionResults()
+        self.vehicle_subs = traci.vehicle.getAllContextSubscriptionResults()
+
+        self.vehicle_ids = list(self.vehicle_vars.keys())
+        self.rows = {vid: i for i, vid in enumerate(self.vehicle_ids)}
+
+        n = len(self.vehicle_ids)
+        self.positions = np.zeros((n, 2), dtype=float)
+        self.speeds = np.zeros(n, dtype=float)
+        self.route_indices = np.zeros(n, dtype=np.int32)
+        self.current_edges = [None] * n
+        for i, vid in enumerate(self.vehicle_ids):
+            variables = self.vehicle_vars[vid]
+            self.positions[i] = variables[tc.VAR_POSITION]
+            self.speeds[i] = variables[tc.VAR_SPEED]
+            route_index = variables[tc.VAR_ROUTE_INDEX]
+            self.route_indices[i] = route_index
+            self.current_edges[i] = variables[tc.VAR_EDGES][route_index]
@@ -1,133 +1,233 @@
-import pprint, textwrap
+import pprint
+from array import array
 import traci
 import traci.constants as tc
 import zope.event
-from shapely.geometry import Point
-from xml.dom import minidom
-from lxml import etree
-from lxml.etree import Element, SubElement
 
 from logger import log
+from polygon_record import PolygonKind
+from tracking_output import (
+    XMLTrackingWriter,
+    XMLSummaryWriter,
+    ColumnarTrackingWriter,
+)
+
+
+def find_polygon(polygons):
+    # SUMO does not support Polygons with holes
+    # Resolve the actual polygon from all polygons of one timestep that contain the vehicle
+    holes = []
+    possible_polygons = []
+    for p in polygons:
+        if p.kind != PolygonKind.ZONE:
+            holes.append(p)
+        else:
+            possible_polygons.append(p)
+
+    for p in possible_polygons:
+        matching_hole = next((h for h in holes if h.zone == p.zone), None,)
+        if matching_hole is not None:
+            if matching_hole.kind == PolygonKind.EMPTY_HOLE:
+                # Vehicle is inside Zone 0
+                return matching_hole
+            else:
+                # Hole is just another nested zone (type: "filled-hole")
+                holes.remove(matching_hole)
+                continue
+        else:
+            # Vehicle is inside a zone
+            return p
 
-
-def prettify(elem, indent=4):
-    ugly_string = etree.tostring(elem, encoding="utf-8")
-    reparsed = minidom.parseString(ugly_string)
-    root = reparsed.childNodes[0]  # remove declaration header
-    return root.toprettyxml(indent=" " * indent)
+    return None
 
 
 class Tracker:
-    def __init__(self, sim_config, zone_controller):
+    def __init__(self, sim_config, zone_controller, vehicle_states):
         self.sim_config = sim_config
         self.zone_controller = zone_controller
-
-        output_file_path = f"{sim_config['sim_outputDir']}/vehicle-zone-tracking.xml"
-        self.output_file = open(output_file_path, "w")
-        self.output_file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-        self.output_file.write("<vehicle-zone-tracking>\n")
+        self.vehicle_states = vehicle_states
+        self.polygons_by_timestep = {}
+        self.edges_by_timestep = {}
+
+        self.tracking_mode = "position"
+        if "trackingMode" in sim_config:
+            self.tracking_mode = sim_config["trackingMode"]
+
+        if self.tracking_mode not in ["position", "edge"]:
+            raise ValueError("Unknown trackingMode value")
+
+        output_format = "xml"
+        if "trackingOutputFormat" in sim_config:
+            output_format = sim_config["trackingOutputFormat"]
+
+        compress = (
+            "compressTrackingOutput" in sim_config
+            and sim_config["compressTrackingOutput"]
+        )
+        compact = (
+            "compactTrackingOutput" in sim_config
+            and sim_config["compactTrackingOutput"]
+        )
+
+        # Aggregation only keeps the driven distance and time per vehicle and zone
+        # and writes a summary when the vehicle arrives instead of records for every step
+        self.aggregate = (
+            "trackingAggregation" in sim_config and sim_config["trackingAggregation"]
+        )
+        self.step_length = traci.simulation.getDeltaT()
+        self.vehicle_info = {}
+        self.zone_totals = {}
+
+        output_file_path = f"{sim_config['sim_outputDir']}/vehicle-zone-tracking"
+        if self.aggregate:
+            self.output_writer = XMLSummaryWriter(
+                f"{sim_config['sim_outputDir']}/vehicle-zone-summary.xml",
+                compress=compress,
+                compact=compact,
+            )
+        elif output_format == "xml":
+            self.output_writer = XMLTrackingWriter(
+                f"{output_file_path}.xml", compress=compress, compact=compact
+            )
+        else:
+            flush_interval = 60
+            if "trackingFlushInterval" in sim_config:
+                flush_interval = int(sim_config["trackingFlushInterval"])
+
+            self.output_writer = ColumnarTrackingWriter(
+                output_file_path,
+                file_format=output_format,
+                flush_interval=flush_interval,
+            )
 
         # Register event handler
         zope.event.subscribers.append(self.event_handler)
 
     def event_handler(self, event):
-        if event == "zone-update":
-            pass
-
-    def track_vehicles_in_polygons(self, t):
-        timestep = self.zone_controller.current_timestep
-        vehicle_vars = traci.vehicle.getAllSubscriptionResults()
-
-        timestep_xml = Element("timestep", {"time": str(t), "zone-timestep": timestep})
-
-        # Sort all polygons by timestep first
-        all_polygons = self.zone_controller.get_polygons()
-        polygons_by_timestep = {}
-        for p in all_polygons:
-            p_timestep = p["zone_timestep"]
-            if p_timestep in polygons_by_timestep:
-                polygons_by_timestep[p_timestep].append(p)
+        if event["name"] == "zone-update":
+            self.update_polygon_groups()
+
+    def update_polygon_groups(self):
+        # Group all polygons by timestep once per zone update instead of on every step
+        self.polygons_by_timestep = {}
+        for p in self.zone_controller.get_polygons():
+            p_timestep = p.zone_timestep
+            if p_timestep in self.polygons_by_timestep:
+                self.polygons_by_timestep[p_timestep].append(p)
             else:
-                polygons_by_timestep[p_timestep] = [p]
+                self.polygons_by_timestep[p_timestep] = [p]
 
-        for vid in traci.vehicle.getIDList():
-            x, y = vehicle_vars[vid][tc.VAR_POSITION]
-            location = Point(x, y)
-            speed = vehicle_vars[vid][tc.VAR_SPEED]
-            emission_class = vehicle_vars[vid][tc.VAR_EMISSIONCLASS]
-            route = vehicle_vars[vid][tc.VAR_EDGES]
-            route_index = vehicle_vars[vid][tc.VAR_ROUTE_INDEX]
-            current_edge = route[route_index]
-            v_timestep = traci.vehicle.getParameter(vid, "zone_timestep")
+        if self.tracking_mode == "edge":
+            # Map every edge to all polygons covering it (in the same order as above)
+            self.edges_by_timestep = {}
+            for timestep, polygons in self.polygons_by_timestep.items():
+                edge_polygons = {}
+                for p in polygons:
+                    for eid in p.edges:
+                        if eid in edge_polygons:
+                            edge_polygons[eid].append(p)
+                        else:
+                            edge_polygons[eid] = [p]
+                self.edges_by_timestep[timestep] = edge_polygons
+
+    def accumulate(self, vid, v_timestep, emission_class, polygon, speed):
+        if vid not in self.zone_totals:
+            self.vehicle_info[vid] = (v_timestep, emission_class)
+            self.zone_totals[vid] = {}
+
+        totals = self.zone_totals[vid]
+        key = (polygon.zone, polygon.zone_timestep)
+        if key in totals:
+            total = totals[key]
+        else:
+            total = array("d", [0, 0])
+            totals[key] = total
+
+        total[0] += speed * self.step_length
+        total[1] += self.step_length
+
+    def write_summary(self, t, vid, arrived=True):
+        if vid not in self.zone_totals:
+            # Vehicle has never been inside a zone
+            return
+
+        v_timestep, emission_class = self.vehicle_info.pop(vid)
+        totals = self.zone_totals.pop(vid)
+        self.output_writer.write_vehicle(
+            t, vid, v_timestep, emission_class, totals.items(), arrived=arrived
+        )
+
+    def track_vehicles_in_polygons(self, snapshot):
+        t = snapshot.step
+        current_timestep = self.zone_controller.current_timestep
+        vehicle_vars = snapshot.vehicle_vars
+
+        if self.aggregate:
+            for vid in snapshot.arrived:
+                self.write_summary(t, vid)
+
+        records = []
+
+        vehicle_ids = snapshot.vehicle_ids
+
+        hits_by_timestep = {}
+        if self.tracking_mode == "position" and len(vehicle_ids) > 0:
+            xs = snapshot.positions[:, 0]
+            ys = snapshot.positions[:, 1]
+            for timestep in self.polygons_by_timestep:
+                # Bulk query against the spatial index of the zone controller
+                hits_by_timestep[timestep] = self.zone_controller.query_points(
+                    xs, ys, timestep
+                )
 
-            vehicle_xml = None
+        for i, vid in enumerate(vehicle_ids):
+            speed = snapshot.speeds[i]
+            emission_class = vehicle_vars[vid][tc.VAR_EMISSIONCLASS]
+            current_edge = snapshot.current_edges[i]
+            v_timestep = self.vehicle_states.get_zone_timestep(vid)
 
             # SUMO does not support Polygons with holes
             # Find the actual polygons that the vehicle is in
-            for timestep in polygons_by_timestep:
-                polygons = polygons_by_timestep[timestep]
-
-                holes = []
-                possible_polygons = []
-                for p in polygons:
-                    shape = p["shape"]
-                    if shape.contains(location):
-                        if p["id"].startswith("hole"):
-                            holes.append(p)
-                        else:
-                            possible_polygons.append(p)
-
-                polygon = None
-                for p in possible_polygons:
-                    matching_hole = next(
-                        (h for h in holes if h["zone"] == p["zone"]), None,
-                    )
-                    if matching_hole is not None:
-                        if matching_hole["type"] == "empty-hole":
-                            # Vehicle is inside Zone 0
-                            polygon = matching_hole
-                            break
-                        else:
-                            # Hole is just another nested zone (type: "filled-hole")
-                            holes.remove(matching_hole)
-                            continue
-                    else:
-                        # Vehicle is inside a zone
-                        polygon = p
-                        break
+            for timestep in self.polygons_by_timestep:
+                if self.tracking_mode == "edge":
+                    hits = self.edges_by_timestep[timestep].get(current_edge, [])
+                    polygon = find_polygon(hits)
+                else:
+                    # Holes have already been resolved
+                    polygon = hits_by_timestep[timestep][i]
 
                 if polygon is None:
                     # Vehicle is in no polygon
                     continue
 
-                if polygon["id"].startswith("hole"):
+                if polygon.kind != PolygonKind.ZONE:
                     # Vehicle is in Zone 0
                     # No need to track the driven distance
                     continue
 
-                if vehicle_xml is None:
-                    vehicle_xml = SubElement(
-                        timestep_xml,
-                        "vehicle",
-                        {
-                            "id": vid,
-                            "zone-timestep": v_timestep,
-                            "speed": str(speed),
-                            "edge": current_edge,
-                            "emission-class": emission_class,
-                        },
-                    )
+                if self.aggregate:
+                    self.accumulate(vid, v_timestep, emission_class, polygon, speed)
+                    continue
 
-                polygon_xml = SubElement(
-                    vehicle_xml,
-                    "polygon",
-                    {"id": polygon["id"], "zone-timestep": polygon["zone_timestep"],},
+                records.append(
+                    (
+                        vid,
+                        v_timestep,
+                        speed,
+                        current_edge,
+                        emission_class,
+                        polygon.id,
+                        polygon.zone_timestep,
+                    )
                 )
 
-        indent = 4
-        xml = prettify(timestep_xml, indent=indent)
-        xml = textwrap.indent(xml, " " * indent)
-        self.output_file.write(xml)
+        if not self.aggregate:
+            self.output_writer.write_step(t, current_timestep, records)
+
+    def finish(self, t):
+        if self.aggregate:
+            # Write the summaries of all vehicles that have not arrived yet
+            for vid in list(self.zone_totals.keys()):
+                self.write_summary(t, vid, arrived=False)
 
-    def finish(self):
-        self.output_file.write("</vehicle-zone-tracking>")
+        self.output_writer.close()
@@ -0,0 +1,204 @@
+import gzip, io
+from lxml import etree
+from lxml.etree import Element, SubElement
+
+# Columns of a single tracking record (one row per vehicle and polygon per step)
+columns = [
+    "step",
+    "vehicle_id",
+    "vehicle_zone_timestep",
+    "speed",
+    "edge",
+    "emission_class",
+    "polygon_id",
+    "polygon_zone_timestep",
+]
+
+
+def xml_writer(output_file, root_tag, indent=4, compact=False):
+    # Incremental XML writer that serializes every element sent to it exactly once
+    # Closing the generator writes the closing root tag
+    output_file.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+    with etree.xmlfile(output_file, encoding="utf-8") as xf:
+        with xf.element(root_tag):
+            xf.write("\n")
+
+            try:
+                while True:
+                    elem = yield
+                    if not compact:
+                        etree.indent(elem, space=" " * indent, level=1)
+                        xf.write(" " * indent)
+                    # Compact mode writes one element per line without indentation
+                    xf.write(elem)
+                    xf.write("\n")
+            except GeneratorExit:
+                pass
+
+
+def open_output_file(output_file_path, compress=False):
+    buffer_size = 1024 * 1024
+    if compress:
+        return io.BufferedWriter(
+            gzip.open(f"{output_file_path}.gz", "wb", compresslevel=6),
+            buffer_size=buffer_size,
+        )
+
+    return open(output_file_path, "wb", buffering=buffer_size)
+
+
+class XMLTrackingWriter:
+    def __init__(self, output_file_path, compress=False, compact=False):
+        self.output_file = open_output_file(output_file_path, compress=compress)
+        self.writer = xml_writer(
+            self.output_file, "vehicle-zone-tracking", compact=compact
+        )
+        next(self.writer)
+
+    def write_step(self, t, timestep, records):
+        timestep_xml = Element("timestep", {"time": str(t), "zone-timestep": timestep})
+
+        # Records of the same vehicle are always consecutive
+        vehicle_xml = None
+        prev_vid = None
+        for record in records:
+            vid, v_timestep, speed, edge, emission_class, pid, p_timestep = record
+            if vid != prev_vid:
+                vehicle_xml = SubElement(
+                    timestep_xml,
+                    "vehicle",
+                    {
+                        "id": vid,
+                        "zone-timestep": v_timestep,
+                        "speed": str(speed),
+                        "edge": edge,
+                        "emission-class": emission_class,
+                    },
+                )
+                prev_vid = vid
+
+            SubElement(
+                vehicle_xml, "polygon", {"id": pid, "zone-timestep": p_timestep,},
+            )
+
+        self.writer.send(timestep_xml)
+
+    def close(self):
+        self.writer.close()
+        self.output_file.close()
+
+
+class XMLSummaryWriter:
+    def __init__(self, output_file_path, compress=False, compact=False):
+        self.output_file = open_output_file(output_file_path, compress=compress)
+        self.writer = xml_writer(
+            self.output_file, "vehicle-zone-summary", compact=compact
+        )
+        next(self.writer)
+
+    def write_vehicle(self, t, vid, v_timestep, emission_class, totals, arrived=True):
+        vehicle_xml = Element(
+            "vehicle",
+            {
+                "id": vid,
+                "zone-timestep": v_timestep,
+                "emission-class": emission_class,
+                "time": str(t),
+                "arrived": str(arrived).lower(),
+            },
+        )
+
+        for (zone, zone_timestep), (distance, time) in totals:
+            SubElement(
+                vehicle_xml,
+                "zone",
+                {
+                    "zone": str(zone),
+                    "zone-timestep": zone_timestep,
+                    "distance": format(distance, ".2f"),
+                    "time": format(time, ".2f"),
+                },
+            )
+
+        self.writer.send(vehicle_xml)
+
+    def close(self):
+        self.writer.close()
+        self.output_file.close()
+
+
+class ColumnarTrackingWriter:
+    def __init__(self, output_file_path, file_format="parquet", flush_interval=60):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError(
+                f'"trackingOutputFormat: {file_format}" requires pyarrow to be installed'
+            )
+
+        self.pa = pa
+        self.file_format = file_format
+        self.flush_interval = flush_interval
+        self.steps = 0
+
+        self.schema = pa.schema(
+            [
+                ("step", pa.int32()),
+                ("vehicle_id", pa.string()),
+                ("vehicle_zone_timestep", pa.string()),
+                ("speed", pa.float64()),
+                ("edge", pa.string()),
+                ("emission_class", pa.string()),
+                ("polygon_id", pa.string()),
+                ("polygon_zone_timestep", pa.string()),
+            ]
+        )
+
+        # In-memory column buffers that are flushed every flush_interval steps
+        self.buffers = {name: [] for name in columns}
+
+        if file_format == "parquet":
+            self.sink = None
+            self.writer = pq.ParquetWriter(
+                f"{output_file_path}.parquet", self.schema, compression="snappy"
+            )
+        elif file_format == "arrow":
+            self.sink = pa.OSFile(f"{output_file_path}.arrow", "wb")
+            self.writer = pa.ipc.new_file(self.sink, self.schema)
+        else:
+            raise ValueError("Unknown trackingOutputFormat value")
+
+    def write_step(self, t, timestep, records):
+        if len(records) > 0:
+            self.buffers["step"].extend([t] * len(records))
+            for i, values in enumerate(zip(*records), start=1):
+                self.buffers[columns[i]].extend(values)
+
+        self.steps += 1
+        if self.steps % self.flush_interval == 0:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffers["step"]) == 0:
+            return
+
+        arrays = [
+            self.pa.array(self.buffers[field.name], type=field.type)
+            for field in self.schema
+        ]
+        batch = self.pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+        if self.file_format == "parquet":
+            # Every flush becomes one row group
+            self.writer.write_table(self.pa.Table.from_batches([batch]))
+        else:
+            self.writer.write_batch(batch)
+
+        self.buffers = {name: [] for name in columns}
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        if self.sink is not None:
+            self.sink.close()
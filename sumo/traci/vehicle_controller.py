@@ -1,58 +1,338 @@
-import pprint, datetime, os
+import pprint, datetime, os, heapq, math, time
 import traci
 import zope.event
 import xml.etree.ElementTree as et
+from lxml import etree
 import traci.constants as tc
 
 from logger import log
+from router import Router, RouterPool, is_pool_supported
+from route_cache import RouteCache
+from decision_tables import DecisionTables, read_person_ids, get_person_id
 import rerouting_decisions
 import depart_decisions
 
 
+# Global penalties are applied from a zone update until they are replaced or reset
+# SUMO looks up the travel time of an edge at the time a vehicle enters it
+# so they must not end before any vehicle can reach the edge
+global_penalty_horizon = 365 * 24 * 60 * 60
+
+
+def read_edge_lanes(net_file):
+    # Only reads the lane lengths and speeds of the network instead of loading all of it
+    # The length and speed of an edge are those of its first lane (like in sumolib)
+    lengths = {}
+    speeds = {}
+    for _, edge in etree.iterparse(net_file, tag="edge"):
+        if edge.get("function") != "internal":
+            lane = edge.find("lane")
+            if lane is not None:
+                lengths[edge.get("id")] = float(lane.get("length"))
+                speeds[edge.get("id")] = float(lane.get("speed"))
+
+        # Free the memory of all edges that have already been read
+        edge.clear()
+        while edge.getprevious() is not None:
+            del edge.getparent()[0]
+
+    return lengths, speeds
+
+
 class VehicleController:
-    def __init__(self, sim_config, zone_controller):
+    def __init__(self, sim_config, zone_controller, vehicle_states):
         self.sim_config = sim_config
         self.zone_controller = zone_controller
+        self.vehicle_states = vehicle_states
         self.non_depart_people = set()
         self.reroute_people = set()
         self.rerouting_period = 5 * 60
         self.periodic_rerouting_steps = {}  # Used for manual periodic rerouting
+        # Vehicles that are due for periodic rerouting per simulation time
+        # Entries of arrived or rescheduled vehicles are skipped when their time has come
+        self.periodic_rerouting_calendar = {}
         self.new_vehicles = []
+        self.snapshot = None
         self.vehicle_vars = {}
         self.vehicle_subs = {}
         self.zoneUpdateReroute = False
+        self.edge_lengths = {}
+
+        # Vehicles that still have to be checked after a zone update, ordered by their distance to the zones
+        # The checks are spread over zoneUpdateRerouteSteps steps and optionally limited by a time budget per step
+        self.zone_update_queue = []
+        self.zone_update_budget = 0
+        self.zone_delta = None  # Changes of the last zone update
+        self.zone_update_steps = 1
+        if "zoneUpdateRerouteSteps" in self.sim_config:
+            self.zone_update_steps = max(
+                1, int(self.sim_config["zoneUpdateRerouteSteps"])
+            )
+        self.zone_update_time_budget = None
+        if (
+            "zoneUpdateRerouteTimeBudget" in self.sim_config
+            and self.sim_config["zoneUpdateRerouteTimeBudget"]
+        ):
+            # Given in milliseconds
+            self.zone_update_time_budget = (
+                self.sim_config["zoneUpdateRerouteTimeBudget"] / 1000
+            )
+
+        # Depart and rerouting decisions are drawn once per person for the whole demand
+        self.depart_probability = depart_decisions.get_probability(self.sim_config)
+        self.rerouting_probability = rerouting_decisions.get_probability(
+            self.sim_config
+        )
+        if (
+            "sim_demandFiltered" in self.sim_config
+            and self.sim_config["sim_demandFiltered"]
+        ):
+            # Non-departing people have already been removed from the route files
+            self.depart_probability = 1
+        self.decision_tables = None
+        if self.depart_probability < 1 or self.rerouting_probability < 1:
+            seed = None
+            if "decisionSeed" in self.sim_config:
+                seed = int(self.sim_config["decisionSeed"])
+
+            person_ids = read_person_ids(self.sim_config["sim_routeFiles"])
+            self.decision_tables = DecisionTables(
+                person_ids,
+                depart_p=self.depart_probability,
+                reroute_p=self.rerouting_probability,
+                seed=seed,
+            )
+            log(f"Drew depart and rerouting decisions for {len(person_ids)} people")
+
+        # Routes are either calculated by SUMO or by the Python router
+        self.router = None
+        self.router_pool = None
+        self.route_requests = {}  # Routes that are calculated at the end of each step
+        self.route_tables = (
+            {}
+        )  # Zone penalties and edge weights per timestep and avoided polygons
+        self.vehicle_route_keys = {}  # Route table used for each rerouted vehicle
+        if "router" in self.sim_config and self.sim_config["router"] == "python":
+            log("Loading network for Python router")
+            self.router = Router(self.sim_config["sim_networkFile"])
+
+            processes = 1
+            if "routingProcesses" in self.sim_config:
+                processes = int(self.sim_config["routingProcesses"])
+
+            if processes > 1 and not is_pool_supported():
+                log(
+                    "Ignoring routingProcesses because worker processes can't be forked on this platform"
+                )
+                processes = 1
+
+            if processes > 1:
+                log(f"Starting {processes} routing processes")
+                self.router_pool = RouterPool(self.router, processes)
+
+        # Vehicles with the same origin, destination and avoided polygons get the same route
+        # during one zone timestep so routes are only calculated once
+        route_cache_size = 10000
+        if "routeCacheSize" in self.sim_config:
+            route_cache_size = int(self.sim_config["routeCacheSize"])
+        self.route_cache = RouteCache(capacity=route_cache_size)
+
+        # Dynamic rerouting finds the zones close to a vehicle either through polygon context subscriptions
+        # or by looking ahead dynamicReroutingDistance meters along the route of the vehicle
+        self.route_lookahead = False
+        if "dynamicReroutingDetection" in self.sim_config:
+            detection = self.sim_config["dynamicReroutingDetection"]
+            if detection == "route":
+                self.route_lookahead = True
+            elif detection != "context":
+                raise ValueError("Unknown dynamicReroutingDetection value")
+
+        # When zones are NOT frozen all vehicles avoid the polygons of the most recent timestep
+        # Their penalized travel times are then set once for all vehicles on every zone update
+        self.global_penalties = (
+            self.router is None
+            and self.sim_config["zoneRerouting"] != "none"
+            and not self.sim_config["snapshotZones"]
+        )
+        self.applied_penalties = (
+            {}
+        )  # Global travel times that are currently set in SUMO
+        self.free_flow_times = (
+            {}
+        )  # Used to reset edges that are not inside of a zone anymore
+
+        # The route lookahead and the zone update scheduler (distance to the next zone)
+        # use the edge lengths of the network instead of asking SUMO for each edge
+        needs_edge_lengths = (
+            self.route_lookahead and self.sim_config["zoneRerouting"] == "dynamic"
+        ) or self.sim_config["rerouteOnZoneUpdate"]
+        if self.router is not None:
+            if needs_edge_lengths:
+                lengths = self.router.lengths.tolist()
+                self.edge_lengths = dict(zip(self.router.edge_ids, lengths))
+        elif needs_edge_lengths or self.global_penalties:
+            log("Reading edge lengths and speeds from network")
+            lengths, speeds = read_edge_lanes(self.sim_config["sim_networkFile"])
+            if needs_edge_lengths:
+                self.edge_lengths = lengths
+            if self.global_penalties:
+                self.free_flow_times = {
+                    eid: lengths[eid] / speeds[eid] for eid in lengths
+                }
 
         # Register event handler
         zope.event.subscribers.append(self.event_handler)
 
     def event_handler(self, event):
-        if event == "zone-update":
+        if event["name"] == "zone-update":
             # Do everything that needs to be done after the zones have updated
+            self.zone_delta = event["delta"]
+            if self.global_penalties:
+                self.apply_global_penalties()
+
+            # Cached routes are only valid for the zones they were calculated with
+            self.route_cache.clear()
+
+            # Only keep the route tables that are still used by rerouted vehicles
+            used_keys = set(self.vehicle_route_keys.values())
+            self.route_tables = {
+                key: table
+                for key, table in self.route_tables.items()
+                if key in used_keys
+            }
+            if self.router_pool is not None:
+                self.router_pool.retain(self.route_tables.keys())
+
             if self.sim_config["rerouteOnZoneUpdate"]:
                 if not self.sim_config["snapshotZones"]:
                     self.zoneUpdateReroute = True
 
+    def apply_global_penalties(self):
+        penalties = self.zone_controller.get_penalties()
+
+        # The travel times are set from now on and partially overwrite the ones of the previous zone update
+        # Only edges whose travel time has changed are sent to SUMO
+        begin = traci.simulation.getTime()
+        end = begin + global_penalty_horizon
+        for eid, t in penalties.items():
+            if self.applied_penalties.get(eid) != t:
+                traci.edge.adaptTraveltime(eid, t, begin, end)
+
+        for eid in self.applied_penalties:
+            if eid not in penalties and eid in self.free_flow_times:
+                # Edge is not inside of a zone anymore
+                # Reset it to its free-flow travel time from now on
+                traci.edge.adaptTraveltime(eid, self.free_flow_times[eid], begin, end)
+
+        self.applied_penalties = dict(penalties)
+
+    def get_route_key(self, timestep, avoid):
+        # Route tables of the Python router are shared by all vehicles that avoid the same polygons
+        key = (timestep, frozenset(avoid))
+        if key not in self.route_tables:
+            self.route_tables[key] = {
+                "penalties": self.zone_controller.get_penalties(timestep, avoid),
+                "weights": None,
+            }
+
+        return key
+
+    def get_route_weights(self, key):
+        table = self.route_tables[key]
+        if table["weights"] is None:
+            table["weights"] = self.router.get_weights(table["penalties"])
+
+        return table["weights"]
+
+    def request_route(self, vid, key, periodic=False):
+        # Routes of the Python router are calculated for all vehicles at once at the end of the step
+        # A later request for the same vehicle in the same step replaces the earlier one
+        route = self.vehicle_vars[vid][tc.VAR_EDGES]
+        route_index = self.vehicle_vars[vid][tc.VAR_ROUTE_INDEX]
+        self.route_requests[vid] = (route[route_index], route[-1], key, periodic)
+
+    def calculate_requested_routes(self):
+        if len(self.route_requests) == 0:
+            return
+
+        vehicle_ids = list(self.route_requests.keys())
+        requests = [self.route_requests[vid] for vid in vehicle_ids]
+        self.route_requests = {}
+
+        # Look up all requests in the route cache first
+        # and only calculate every missing route once
+        routes = []
+        missing = {}  # Route cache key -> indices of the requests
+        for i, (from_edge, to_edge, key, _) in enumerate(requests):
+            cache_key = (from_edge, to_edge) + key
+            route = self.route_cache.get(cache_key)
+            if route is None:
+                missing.setdefault(cache_key, []).append(i)
+            routes.append(route)
+
+        cache_keys = list(missing.keys())
+        if (
+            self.router_pool is not None
+            and len(cache_keys) > self.router_pool.processes
+        ):
+            keys = set(cache_key[2:] for cache_key in cache_keys)
+            penalties = {key: self.route_tables[key]["penalties"] for key in keys}
+            new_routes = self.router_pool.route_all(
+                [
+                    (cache_key[0], cache_key[1], cache_key[2:])
+                    for cache_key in cache_keys
+                ],
+                penalties,
+            )
+        else:
+            new_routes = [
+                self.router.route(
+                    cache_key[0], cache_key[1], self.get_route_weights(cache_key[2:])
+                )
+                for cache_key in cache_keys
+            ]
+
+        for cache_key, route in zip(cache_keys, new_routes):
+            if route is not None:
+                self.route_cache.put(cache_key, route)
+            for i in missing[cache_key]:
+                routes[i] = route
+
+        # Apply all new routes in one batch
+        for vid, request, new_route in zip(vehicle_ids, requests, routes):
+            periodic = request[3]
+            if new_route is None:
+                log(f"No route found for vehicle {vid}")
+                new_route = self.vehicle_vars[vid][tc.VAR_EDGES]
+            else:
+                try:
+                    traci.vehicle.setRoute(vid, new_route)
+                except traci.TraCIException as e:
+                    log(f"Could not set route of vehicle {vid}: {e}")
+                    new_route = self.vehicle_vars[vid][tc.VAR_EDGES]
+
+            if not periodic:
+                self.finish_reroute(vid, new_route)
+
     def should_vehicle_avoid_polygon(self, vid, polygon):
         # This function can be used to avoid only specific zones/polygons
         # For example an agent is fine with paying for zone 1 but not zone 2 and 3
 
-        pid = polygon["id"]
+        pid = polygon.id
 
-        # Check the cached list
-        polygon_list = traci.vehicle.getParameter(vid, "avoid_polygons")
-        if pid in polygon_list.split(","):
+        # Check the cached set
+        if self.vehicle_states.is_avoiding_polygon(vid, pid):
             return True
 
         # Make sure to only consider polygons from the correct timestep
-        v_timestep = traci.vehicle.getParameter(vid, "zone_timestep")
-        p_timestep = polygon["zone_timestep"]
+        # Timesteps are compared in seconds
         if self.sim_config["snapshotZones"]:
             # When zones are frozen only consider the polygons that existed at the time when the vehicle was inserted
-            if p_timestep != v_timestep:
+            if polygon.timestep != self.vehicle_states.get_zone_time(vid):
                 return False
         else:
             # When zones are NOT frozen only consider the most recent polygons
-            if p_timestep != self.zone_controller.current_timestep:
+            if polygon.timestep != self.zone_controller.current_time:
                 return False
 
         avoid = True
@@ -60,11 +340,9 @@ class VehicleController:
         # FUTURE WORK
         # Add further logic here
 
-        # Cache the list of polygons that should be avoided
+        # Cache the set of polygons that should be avoided
         if avoid:
-            polygon_list = traci.vehicle.getParameter(vid, "avoid_polygons")
-            polygon_list += f"{pid},"
-            traci.vehicle.setParameter(vid, "avoid_polygons", polygon_list)
+            self.vehicle_states.avoid_polygon(vid, pid)
 
         return avoid
 
@@ -73,83 +351,109 @@ class VehicleController:
         # Example: Use demographic data, price sensitivity, route length, vehicle type, random etc.
 
         # Check if vehicle has already made a decision
-        rerouting_decision = traci.vehicle.getParameter(vid, "rerouting_decision")
-        if rerouting_decision != "":
-            return rerouting_decision == "True"
+        rerouting_decision = self.vehicle_states.get_rerouting_decision(vid)
+        if rerouting_decision is not None:
+            return rerouting_decision
+
+        # Look up the precomputed decision of the person
+        person_index = self.vehicle_states.get_person(vid)
+        if person_index != -1:
+            decision = self.decision_tables.should_reroute(person_index)
+            self.vehicle_states.set_rerouting_decision(vid, decision)
+            return decision
 
         decision = True
 
         # Check if this person has decided to reroute
-        person, counter = vid.split("_")
+        person = get_person_id(vid)
         if person in self.reroute_people:
             decision = True
-            traci.vehicle.setParameter(vid, "rerouting_decision", str(decision))
+            self.vehicle_states.set_rerouting_decision(vid, decision)
             return decision
 
         # Insert more complex logic into rerouting_decisions.py to here to change the 'decision' variable
-        if "reroutingDecisionMode" in self.sim_config:
-            mode = self.sim_config["reroutingDecisionMode"]
-            if mode == "percent":
-                if "reroutingPercent" not in self.sim_config:
-                    raise ValueError(
-                        '"reroutingDecisionMode: percent" requires the configuration key "reroutingPercent"'
-                    )
-                p = self.sim_config["reroutingPercent"]
-                decision = rerouting_decisions.percent(p=p)
-            if mode == "random":
-                decision = rerouting_decisions.random()
+        if self.rerouting_probability < 1:
+            decision = rerouting_decisions.percent(p=self.rerouting_probability)
 
         if decision:
             self.reroute_people.add(person)
 
-        traci.vehicle.setParameter(vid, "rerouting_decision", str(decision))
+        self.vehicle_states.set_rerouting_decision(vid, decision)
         return decision
 
     def has_vehicle_rerouted(self, vid):
         # Check if vehicle has already made a decision if to reroute at all or not
-        rerouting_decision = traci.vehicle.getParameter(vid, "rerouting_decision")
-        return rerouting_decision != ""
+        return self.vehicle_states.get_rerouting_decision(vid) is not None
 
     def reroute_vehicle(self, vid, timestep=None):
         log(f"Rerouting vehicle {vid}")
 
-        traveltime = 999
-
-        do_not_avoid = []
-
         # Decide per polygon if to avoid it or not
-        polygons = self.zone_controller.get_polygons_by_timestep(timestep=timestep)
-        for polygon in polygons:
-            # Handle holes
-            if polygon["id"].startswith("hole"):
-                if polygon["type"] == "empty-hole":
-                    do_not_avoid.append(polygon)
-
-                continue
-
-            # Handle regular zone polygons
-            if self.should_vehicle_avoid_polygon(vid, polygon):
-                for eid in polygon["edges"]:
-                    # Set travel times for all edges to very high value
-                    # More polluted zones get a higher traveltime
-                    t = float(traveltime * (polygon["zone"] ** 2))
-                    traci.vehicle.setAdaptedTraveltime(vid, eid, time=t)
-            else:
-                do_not_avoid.append(polygon)
-
-        for polygon in do_not_avoid:
-            # Make sure holes and other polygons that should not be avoided have 0 traveltime
-            # Do this step separately after the loop above because SUMO can't deal with polygons that have holes
-            # This basically partially overwrites some weights set above because polygons are layered
-            for eid in polygon["edges"]:
-                traci.vehicle.setAdaptedTraveltime(vid, eid, time=0)
-
-        traci.vehicle.rerouteTraveltime(vid, False)
-
-        old_route = self.vehicle_vars[vid][tc.VAR_EDGES]
-        new_route = traci.vehicle.getRoute(vid)
+        polygons = self.zone_controller.get_polygons_by_timestep(
+            timestep=timestep, holes=False
+        )
+        avoid = [p.id for p in polygons if self.should_vehicle_avoid_polygon(vid, p)]
+
+        timestep = timestep or self.zone_controller.current_timestep
+
+        if self.router is not None:
+            # Calculate the route in Python and only send the result to SUMO
+            key = self.get_route_key(timestep, avoid)
+            self.vehicle_route_keys[vid] = key
+            self.request_route(vid, key)
+        else:
+            # Check if the penalized travel times have already been set for all vehicles
+            uses_global_penalties = (
+                self.global_penalties
+                and timestep == self.zone_controller.current_timestep
+                and len(avoid) == len(polygons)
+            )
 
-        if old_route == new_route:
+            route = self.vehicle_vars[vid][tc.VAR_EDGES]
+            current_edge = route[self.vehicle_vars[vid][tc.VAR_ROUTE_INDEX]]
+            cache_key = (current_edge, route[-1], timestep, frozenset(avoid))
+            cached_route = self.route_cache.get(cache_key)
+
+            # The adapted travel times are still needed for periodic rerouting
+            # even if the route itself comes from the cache
+            needs_penalties = not uses_global_penalties
+            if needs_penalties and (
+                cached_route is None or self.sim_config["periodicRerouting"]
+            ):
+                self.set_vehicle_penalties(vid, timestep, avoid)
+                needs_penalties = False
+
+            new_route = None
+            if cached_route is not None:
+                try:
+                    traci.vehicle.setRoute(vid, cached_route)
+                    new_route = cached_route
+                except traci.TraCIException as e:
+                    # E.g. the vehicle type is not allowed on an edge of the cached route
+                    log(f"Could not set cached route of vehicle {vid}: {e}")
+
+            if new_route is None:
+                if needs_penalties:
+                    self.set_vehicle_penalties(vid, timestep, avoid)
+                traci.vehicle.rerouteTraveltime(vid, False)
+                new_route = traci.vehicle.getRoute(vid)
+                if new_route[0] == current_edge:
+                    self.route_cache.put(cache_key, new_route)
+
+            self.finish_reroute(vid, new_route)
+
+    def set_vehicle_penalties(self, vid, timestep, avoid):
+        # Penalized travel times are shared between all vehicles with the same polygons to avoid
+        penalties = self.zone_controller.get_penalties(timestep, avoid)
+        for eid, t in penalties.items():
+            traci.vehicle.setAdaptedTraveltime(vid, eid, time=t)
+
+    def finish_reroute(self, vid, new_route):
+        # New routes start at the current edge and can be lists (Python router) or tuples (SUMO)
+        route_index = self.vehicle_vars[vid][tc.VAR_ROUTE_INDEX]
+        old_route = self.vehicle_vars[vid][tc.VAR_EDGES][route_index:]
+
+        if tuple(old_route) == tuple(new_route):
             log("Route has not changed")
             traci.vehicle.setColor(vid, (0, 0, 255))
         else:
@@ -162,84 +466,134 @@ class VehicleController:
             traci.vehicle.setParameter(vid, "device.rerouting.period", "0")
             # Add vehicle to manual periodic rerouting list
             # Do manual periodic rerouting every 5 minutes
-            self.periodic_rerouting_steps[vid] = (
-                traci.simulation.getTime() + self.rerouting_period
+            self.schedule_periodic_rerouting(
+                vid, self.snapshot.time + self.rerouting_period
             )
 
-    def static_rerouting(self, zone_update=False):
-        vehicleToCheck = []
-        if zone_update:
-            # Only executed when rerouteOnZoneUpdate is true
-            # Zones have updated so we want to check all vehicles, not only the new ones
-            vehicleToCheck = traci.vehicle.getIDList()
-        else:
-            # Only check the new ones
-            vehicleToCheck = self.new_vehicles
+    def schedule_periodic_rerouting(self, vid, time):
+        if self.periodic_rerouting_steps.get(vid) == time:
+            # Vehicle has already been rerouted in this step and is scheduled for this time
+            return
 
-        # Rerouting for vehicles whose route crosses through air quality zones
-        for vid in vehicleToCheck:
-            route = self.vehicle_vars[vid][tc.VAR_EDGES]
-            current_route_index = self.vehicle_vars[vid][tc.VAR_ROUTE_INDEX]
-            upcoming_edges = route[current_route_index:]
-
-            # Check if route includes edges that are within air quality zone polygons of current timestep
-            for polygon in self.zone_controller.get_polygons_by_timestep(holes=False):
-                pid = polygon["id"]
-                polygon_edges = polygon["edges"]
-
-                intersecting_edges = list(set(upcoming_edges) & set(polygon_edges))
-                n_intersect = len(intersecting_edges)
-                if n_intersect != 0:
-                    if not self.should_vehicle_reroute(vid):
-                        break
-
-                    if upcoming_edges[0] in polygon_edges:
-                        if zone_update:
-                            log(
-                                f"Vehicle {vid} was inside polygon {pid} during zone update"
-                            )
-                        else:
-                            log(f"New vehicle {vid} was inserted inside polygon {pid}")
-
-                    log_msg = f"Vehicle {vid} route intersects with zone polygon {pid} "
-                    if n_intersect > 1:
-                        log_msg += (
-                            f"(edge {intersecting_edges[0]} and {n_intersect - 1} more)"
-                        )
-                    else:
-                        log_msg += f"(edge {intersecting_edges[0]})"
-                    log(log_msg)
+        self.periodic_rerouting_steps[vid] = time
+        if time not in self.periodic_rerouting_calendar:
+            self.periodic_rerouting_calendar[time] = []
+        self.periodic_rerouting_calendar[time].append(vid)
 
-                    # Check for special case where destination is inside a zone
-                    if upcoming_edges[-1] in polygon_edges:
-                        # TODO: What to do?
-                        # Don't reroute at all? Or maybe find the "cheapest" way to destination?
-                        log(f"Destination of vehicle {vid} is in polygon {pid}")
+    def get_edge_length(self, eid):
+        if eid not in self.edge_lengths:
+            if self.router is not None and eid in self.router.edge_indices:
+                length = self.router.lengths[self.router.edge_indices[eid]]
+            else:
+                length = traci.lane.getLength(f"{eid}_0")
+            self.edge_lengths[eid] = float(length)
+
+        return self.edge_lengths[eid]
+
+    def get_zone_distance(self, vid):
+        # Distance along the upcoming route until the first edge inside of a zone
+        # Returns None if the route doesn't pass through any zone
+        route = self.vehicle_vars[vid][tc.VAR_EDGES]
+        route_index = self.vehicle_vars[vid][tc.VAR_ROUTE_INDEX]
+        upcoming_edges = route[route_index:]
+
+        zone_edges = set()
+        for _, edges in self.zone_controller.get_route_intersections(upcoming_edges):
+            zone_edges.update(edges)
+        if len(zone_edges) == 0:
+            return None
+
+        distance = 0
+        for eid in upcoming_edges:
+            if eid in zone_edges:
+                break
+            distance += self.get_edge_length(eid)
+
+        return distance
+
+    def schedule_zone_update_rerouting(self):
+        # Vehicles that are closest to a zone are checked first after a zone update
+        # Vehicles whose route doesn't pass through any of the new zones don't have to be checked at all
+        # and neither do vehicles whose route doesn't touch any edge that has changed its zone
+        changed_edges = None
+        if self.zone_delta is not None and self.zone_delta["previous_timestep"] != "":
+            changed_edges = self.zone_delta["edges"]
+
+        new_vehicles = set(self.new_vehicles)
+        self.zone_update_queue = []
+        for vid in self.snapshot.vehicle_ids:
+            if vid in new_vehicles:
+                continue
+
+            if changed_edges is not None:
+                route = self.vehicle_vars[vid][tc.VAR_EDGES]
+                route_index = self.vehicle_vars[vid][tc.VAR_ROUTE_INDEX]
+                if changed_edges.isdisjoint(route[route_index:]):
+                    continue
 
-                    self.reroute_vehicle(vid)
+            distance = self.get_zone_distance(vid)
+            if distance is not None:
+                self.zone_update_queue.append((distance, vid))
+        heapq.heapify(self.zone_update_queue)
+
+        self.zone_update_budget = math.ceil(
+            len(self.zone_update_queue) / self.zone_update_steps
+        )
+        log(
+            f"Checking {len(self.zone_update_queue)} vehicles for zone update rerouting"
+        )
+
+    def check_zone_update_vehicles(self, check_vehicle):
+        # Checks the next vehicles of the zone update queue until the budget of this step is used up
+        # Returns the checked vehicles
+        checked = set()
+        start_time = time.time()
+        while (
+            len(self.zone_update_queue) > 0 and len(checked) < self.zone_update_budget
+        ):
+            if self.zone_update_time_budget is not None and len(checked) > 0:
+                if time.time() - start_time >= self.zone_update_time_budget:
                     break
 
-    def dynamic_rerouting(self, zone_update=False):
-        # 1. Check for new/all vehicles if current edge is within one of the polygons
-        vehicleToCheck = []
-        if zone_update:
-            # Zones have updated so we want to check all vehicles, not only the new ones
-            vehicleToCheck = traci.vehicle.getIDList()
-        else:
-            # Only check the new ones
-            vehicleToCheck = self.new_vehicles
+            _, vid = heapq.heappop(self.zone_update_queue)
+            if vid not in self.snapshot.rows:
+                # Vehicle has arrived in the meantime
+                continue
 
-        # Check all the newly spawned vehicles if any of them are located within the zone
-        for vid in vehicleToCheck:
-            route = self.vehicle_vars[vid][tc.VAR_EDGES]
-            route_index = self.vehicle_vars[vid][tc.VAR_ROUTE_INDEX]
-            current_edge = route[route_index]
-
-            # Check if starting edge is within any of the polygons
-            for polygon in self.zone_controller.get_polygons_by_timestep(holes=False):
-                pid = polygon["id"]
-                polygon_edges = polygon["edges"]
-                if current_edge in polygon_edges:
+            check_vehicle(vid)
+            checked.add(vid)
+
+        return checked
+
+    def static_rerouting(self):
+        # Only check the new vehicles
+        for vid in self.new_vehicles:
+            self.static_check_vehicle(vid)
+
+        # When rerouteOnZoneUpdate is true all vehicles are checked again after a zone update
+        self.check_zone_update_vehicles(
+            lambda vid: self.static_check_vehicle(vid, zone_update=True)
+        )
+
+    def static_check_vehicle(self, vid, zone_update=False):
+        # Rerouting for vehicles whose route crosses through air quality zones
+        route = self.vehicle_vars[vid][tc.VAR_EDGES]
+        current_route_index = self.vehicle_vars[vid][tc.VAR_ROUTE_INDEX]
+        upcoming_edges = route[current_route_index:]
+
+        # Check if route includes edges that are within air quality zone polygons of current timestep
+        intersections = self.zone_controller.get_route_intersections(upcoming_edges)
+        for polygon, edges in intersections:
+            pid = polygon.id
+            polygon_edges = polygon.edges
+
+            intersecting_edges = list(edges)
+            n_intersect = len(intersecting_edges)
+            if n_intersect != 0:
+                if not self.should_vehicle_reroute(vid):
+                    return
+
+                if upcoming_edges[0] in polygon_edges:
                     if zone_update:
                         log(
                             f"Vehicle {vid} was inside polygon {pid} during zone update"
@@ -247,107 +601,193 @@ class VehicleController:
                     else:
                         log(f"New vehicle {vid} was inserted inside polygon {pid}")
 
-                    # Make decision if to reroute at all
-                    if not self.should_vehicle_reroute(vid):
-                        break
+                log_msg = f"Vehicle {vid} route intersects with zone polygon {pid} "
+                if n_intersect > 1:
+                    log_msg += (
+                        f"(edge {intersecting_edges[0]} and {n_intersect - 1} more)"
+                    )
+                else:
+                    log_msg += f"(edge {intersecting_edges[0]})"
+                log(log_msg)
+
+                # Check for special case where destination is inside a zone
+                if upcoming_edges[-1] in polygon_edges:
+                    # TODO: What to do?
+                    # Don't reroute at all? Or maybe find the "cheapest" way to destination?
+                    log(f"Destination of vehicle {vid} is in polygon {pid}")
 
-                    # Check for special case where destination is inside a zone
-                    if route[-1] in polygon_edges:
-                        # TODO: What to do?
-                        # Don't reroute at all? Or maybe find the "cheapest" way to destination?
-                        log(f"Destination of vehicle {vid} is in polygon {pid}")
+                self.reroute_vehicle(vid)
+                return
 
-                    self.reroute_vehicle(vid)
-                    break
+    def dynamic_rerouting(self):
+        # 1. Check for new vehicles if current edge is within one of the polygons
+        for vid in self.new_vehicles:
+            self.dynamic_check_current_edge(vid)
 
-        polygon_ids = self.zone_controller.get_polygon_ids()
+        # After a zone update all vehicles are checked again, even if they have already rerouted
+        def check_vehicle(vid):
+            self.dynamic_check_current_edge(vid, zone_update=True)
+            self.dynamic_check_route(vid)
+
+        checked = self.check_zone_update_vehicles(check_vehicle)
 
         # 2. Check if any vehicles are within dynamicReroutingDistance to any polygon
         # Vehicle subs contain all vehicles that have a polygon within dynamicReroutingDistance
-        for vid in self.vehicle_subs:
-            if not zone_update:
-                if self.has_vehicle_rerouted(vid):
-                    # When vehicle has already rerouted we don't want it to reroute again
-                    continue
+        # With the route lookahead every vehicle has to be checked
+        candidates = self.vehicle_subs
+        if self.route_lookahead:
+            candidates = self.snapshot.vehicle_ids
+
+        for vid in candidates:
+            if vid in checked:
+                continue
+
+            if self.has_vehicle_rerouted(vid):
+                # When vehicle has already rerouted we don't want it to reroute again
+                continue
 
-            vehicle = self.vehicle_vars[vid]
-            route = vehicle[tc.VAR_EDGES]
-            current_route_index = vehicle[tc.VAR_ROUTE_INDEX]
-            upcoming_edges = route[current_route_index:]
-            v_timestep = traci.vehicle.getParameter(vid, "zone_timestep")
+            self.dynamic_check_route(vid)
 
-            # Loop through all polygons within dynamicReroutingDistance
-            # Check if any of the upcoming edges intersect with any of the polygons
+    def dynamic_check_current_edge(self, vid, zone_update=False):
+        route = self.vehicle_vars[vid][tc.VAR_EDGES]
+        route_index = self.vehicle_vars[vid][tc.VAR_ROUTE_INDEX]
+        current_edge = route[route_index]
+
+        # Check if current edge is within any of the polygons
+        for polygon in self.zone_controller.get_edge_polygons(current_edge):
+            pid = polygon.id
+            polygon_edges = polygon.edges
+            if current_edge in polygon_edges:
+                if zone_update:
+                    log(f"Vehicle {vid} was inside polygon {pid} during zone update")
+                else:
+                    log(f"New vehicle {vid} was inserted inside polygon {pid}")
+
+                # Make decision if to reroute at all
+                if not self.should_vehicle_reroute(vid):
+                    return
+
+                # Check for special case where destination is inside a zone
+                if route[-1] in polygon_edges:
+                    # TODO: What to do?
+                    # Don't reroute at all? Or maybe find the "cheapest" way to destination?
+                    log(f"Destination of vehicle {vid} is in polygon {pid}")
+
+                self.reroute_vehicle(vid)
+                return
+
+    def get_lookahead_polygons(self, vid, timestep):
+        # Returns the ids of all polygons of the timestep that the vehicle reaches
+        # within dynamicReroutingDistance along its upcoming route
+        vehicle = self.vehicle_vars[vid]
+        route = vehicle[tc.VAR_EDGES]
+        distance = -vehicle[tc.VAR_LANEPOSITION]
+        max_distance = self.sim_config["dynamicReroutingDistance"]
+
+        polygons = []
+        for eid in route[vehicle[tc.VAR_ROUTE_INDEX] :]:
+            if distance > max_distance:
+                break
+
+            for polygon in self.zone_controller.get_edge_polygons(eid, timestep):
+                if polygon.id not in polygons:
+                    polygons.append(polygon.id)
+            distance += self.get_edge_length(eid)
+
+        return polygons
+
+    def dynamic_check_route(self, vid):
+        vehicle = self.vehicle_vars[vid]
+        route = vehicle[tc.VAR_EDGES]
+        current_route_index = vehicle[tc.VAR_ROUTE_INDEX]
+        upcoming_edges = route[current_route_index:]
+        v_timestep = self.vehicle_states.get_zone_timestep(vid)
+
+        if self.sim_config["snapshotZones"]:
+            # When zones are frozen only consider the polygons that existed at the time when the vehicle was inserted
+            timestep = v_timestep
+        else:
+            # When zones are NOT frozen only consider the most recent polygons
+            timestep = self.zone_controller.current_timestep
+
+        # Polygons within dynamicReroutingDistance
+        if self.route_lookahead:
+            polygons = self.get_lookahead_polygons(vid, timestep)
+        elif vid in self.vehicle_subs:
             polygons = self.vehicle_subs[vid]
-            for pid in polygons:
-                if pid.startswith("hole"):
-                    continue
+        else:
+            polygons = []
 
-                if pid not in polygon_ids:
-                    # Skip possibly removed polygons
-                    continue
+        if len(polygons) == 0:
+            return
+
+        # Find all polygons of that timestep that the upcoming edges pass through at once
+        intersections = {
+            polygon.id: edges
+            for polygon, edges in self.zone_controller.get_route_intersections(
+                upcoming_edges, timestep=timestep
+            )
+        }
+        if len(intersections) == 0:
+            return
+
+        # Loop through all polygons within dynamicReroutingDistance
+        # Check if any of the upcoming edges intersect with any of the polygons
+        for pid in polygons:
+            if pid not in intersections:
+                # Skip holes, possibly removed polygons, polygons from another timestep
+                # and polygons that the route doesn't go through
+                continue
+
+            polygon = self.zone_controller.get_polygon(pid)
+            p_timestep = polygon.zone_timestep
+            polygon_edges = polygon.edges
 
-                polygon = self.zone_controller.get_polygon(pid)
-                p_timestep = polygon["zone_timestep"]
-                polygon_edges = polygon["edges"]
+            # Check if any edge of vehicle route goes through polygon
+            intersecting_edges = list(intersections[pid])
+            n_intersect = len(intersecting_edges)
+            if n_intersect != 0:
+                # Make decision if to reroute at all
+                if not self.should_vehicle_reroute(vid):
+                    continue
 
-                if self.sim_config["snapshotZones"]:
-                    # When zones are frozen only consider the polygons that existed at the time when the vehicle was inserted
-                    if p_timestep != v_timestep:
-                        continue
+                log_msg = f"Vehicle {vid} route intersects with zone polygon {pid} "
+                if n_intersect > 1:
+                    log_msg += (
+                        f"(edge {intersecting_edges[0]} and {n_intersect - 1} more)"
+                    )
                 else:
-                    # When zones are NOT frozen only consider the most recent polygons
-                    if p_timestep != self.zone_controller.current_timestep:
-                        continue
-
-                # Check if any edge of vehicle route goes through polygon
-                intersecting_edges = list(set(upcoming_edges) & set(polygon_edges))
-                n_intersect = len(intersecting_edges)
-                if n_intersect != 0:
-                    # Make decision if to reroute at all
-                    if not self.should_vehicle_reroute(vid):
-                        continue
-
-                    log_msg = f"Vehicle {vid} route intersects with zone polygon {pid} "
-                    if n_intersect > 1:
-                        log_msg += (
-                            f"(edge {intersecting_edges[0]} and {n_intersect - 1} more)"
-                        )
-                    else:
-                        log_msg += f"(edge {intersecting_edges[0]})"
-                    log(log_msg)
+                    log_msg += f"(edge {intersecting_edges[0]})"
+                log(log_msg)
 
-                    # Check if destination is within polygon
-                    if upcoming_edges[-1] in polygon_edges:
-                        # TODO: What to do in the case that the destination is inside a zone?
-                        # Don't reroute at all? Or maybe find the "cheapest" way to destination?
-                        log(f"Destination of vehicle {vid} is in polygon {pid}")
+                # Check if destination is within polygon
+                if upcoming_edges[-1] in polygon_edges:
+                    # TODO: What to do in the case that the destination is inside a zone?
+                    # Don't reroute at all? Or maybe find the "cheapest" way to destination?
+                    log(f"Destination of vehicle {vid} is in polygon {pid}")
 
-                    self.reroute_vehicle(vid, timestep=p_timestep)
+                self.reroute_vehicle(vid, timestep=p_timestep)
 
     def should_vehicle_depart(self, vid):
+        if self.decision_tables is not None:
+            # Look up the precomputed decision of the person
+            person_index = self.decision_tables.get_person_index(vid)
+            if person_index != -1:
+                return self.decision_tables.should_depart(person_index)
+
         decision = True
-        if "nonDepartDecisionMode" in self.sim_config:
-            mode = self.sim_config["nonDepartDecisionMode"]
-            if mode == "percent":
-                if "nonDepartPercent" not in self.sim_config:
-                    raise ValueError(
-                        '"nonDepartDecisionMode: percent" requires the configuration key "nonDepartPercent"'
-                    )
-                p = 1 - self.sim_config["nonDepartPercent"]
-                decision = depart_decisions.percent(p=p)
-            if mode == "random":
-                decision = depart_decisions.random()
+        if self.depart_probability < 1:
+            decision = depart_decisions.percent(p=self.depart_probability)
 
         return decision
 
-    def prepare_new_vehicles(self):
+    def prepare_new_vehicles(self, snapshot):
         # This implementation for non-depart requires
         # adding "step < 24 * 60 * 60" to the while condition in simulation_controller
-        loaded_vehicles = traci.simulation.getLoadedIDList()
-        self.new_vehicles = traci.simulation.getDepartedIDList()
+        loaded_vehicles = snapshot.loaded
+        self.new_vehicles = snapshot.departed
         for vid in loaded_vehicles:
-            person, counter = vid.split("_")
+            person = get_person_id(vid)
             if person in self.non_depart_people:
                 traci.vehicle.remove(vid)
                 log(f"Remove vehicle {vid} due to non-depart")
@@ -378,56 +818,92 @@ class VehicleController:
 
         for vid in self.new_vehicles:
             # Store the timestep when a vehicle was inserted into the simulation
-            traci.vehicle.setParameter(
-                vid, "zone_timestep", self.zone_controller.current_timestep
-            )
-            traci.vehicle.subscribe(
-                vid,
-                [
-                    tc.VAR_POSITION,  # Used to check if vehicles are inside a zones
-                    tc.VAR_SPEED,  # Used to track vehicle distances in the zones
-                    tc.VAR_EDGES,  # Used to check if the route passes through zones
-                    tc.VAR_ROUTE_INDEX,  # Vehicles that have their destination within the zone shouldn't be rerouted
-                    tc.VAR_EMISSIONCLASS,  # Used to distinguish between gas, electric and other car types
-                ],
+            person_index = -1
+            if self.decision_tables is not None:
+                person_index = self.decision_tables.get_person_index(vid)
+            self.vehicle_states.add(
+                vid, self.zone_controller.current_timestep, person=person_index
             )
-            traci.vehicle.subscribeContext(
-                vid,
-                tc.CMD_GET_POLYGON_VARIABLE,
-                self.sim_config["dynamicReroutingDistance"],
-                [tc.ID_COUNT],
-            )
-
-    def clean_up_vehicles(self):
-        arrived_vehicles = traci.simulation.getArrivedIDList()
+            variables = [
+                tc.VAR_POSITION,  # Used to check if vehicles are inside a zones
+                tc.VAR_SPEED,  # Used to track vehicle distances in the zones
+                tc.VAR_EDGES,  # Used to check if the route passes through zones
+                tc.VAR_ROUTE_INDEX,  # Vehicles that have their destination within the zone shouldn't be rerouted
+                tc.VAR_EMISSIONCLASS,  # Used to distinguish between gas, electric and other car types
+            ]
+            if self.route_lookahead:
+                # Used to measure the distance along the route to the zones
+                variables.append(tc.VAR_LANEPOSITION)
+            traci.vehicle.subscribe(vid, variables)
+
+            if not self.route_lookahead:
+                traci.vehicle.subscribeContext(
+                    vid,
+                    tc.CMD_GET_POLYGON_VARIABLE,
+                    self.sim_config["dynamicReroutingDistance"],
+                    [tc.ID_COUNT],
+                )
+
+    def clean_up_vehicles(self, snapshot):
+        arrived_vehicles = snapshot.arrived
         for vid in arrived_vehicles:
+            self.vehicle_states.remove(vid)
+            if vid in self.vehicle_route_keys:
+                del self.vehicle_route_keys[vid]
             if vid in self.periodic_rerouting_steps:
                 del self.periodic_rerouting_steps[vid]
 
-    def reroute(self):
+    def reroute(self, snapshot):
         # Get subscriptions
-        self.vehicle_vars = traci.vehicle.getAllSubscriptionResults()
-        self.vehicle_subs = traci.vehicle.getAllContextSubscriptionResults()
+        self.snapshot = snapshot
+        self.vehicle_vars = snapshot.vehicle_vars
+        self.vehicle_subs = snapshot.vehicle_subs
+
+        if self.zoneUpdateReroute:
+            self.zoneUpdateReroute = False
+            self.schedule_zone_update_rerouting()
 
         if self.sim_config["zoneRerouting"] == "static":
-            self.static_rerouting(zone_update=self.zoneUpdateReroute)
+            self.static_rerouting()
         elif self.sim_config["zoneRerouting"] == "dynamic":
-            self.dynamic_rerouting(zone_update=self.zoneUpdateReroute)
+            self.dynamic_rerouting()
         else:
             raise ValueError("Unknown zoneRerouting value")
 
         if self.sim_config["periodicRerouting"]:
             # Check if any previously rerouted vehicle needs their route to be periodically re-checked
-            current_time = traci.simulation.getTime()
-            for vid in self.periodic_rerouting_steps:
-                step = self.periodic_rerouting_steps[vid]
-                if current_time == step:
-                    # If rerouting period has passed reroute again to make sure
-                    # the vehicle is on the optimal route
+            # Only the vehicles that are due in this step are looked at
+            # Stale entries of vehicles that have been rescheduled are skipped and
+            # a vehicle that has been scheduled for the same time again is only rerouted once
+            current_time = snapshot.time
+            due_vehicles = [
+                vid
+                for vid in dict.fromkeys(
+                    self.periodic_rerouting_calendar.pop(current_time, [])
+                )
+                if self.periodic_rerouting_steps.get(vid) == current_time
+            ]
+
+            # If rerouting period has passed reroute again to make sure
+            # the vehicle is on the optimal route
+            if self.router is not None:
+                for vid in due_vehicles:
+                    if vid not in self.route_requests:
+                        self.request_route(
+                            vid, self.vehicle_route_keys[vid], periodic=True
+                        )
+            else:
+                for vid in due_vehicles:
                     traci.vehicle.rerouteTraveltime(vid, False)
-                    self.periodic_rerouting_steps[vid] = (
-                        current_time + self.rerouting_period
-                    )
 
-        if self.zoneUpdateReroute:
-            self.zoneUpdateReroute = False
+            for vid in due_vehicles:
+                self.schedule_periodic_rerouting(
+                    vid, current_time + self.rerouting_period
+                )
+
+        if self.router is not None:
+            self.calculate_requested_routes()
+
+    def finish(self):
+        if self.router_pool is not None:
+            self.router_pool.close()
@@ -0,0 +1,137 @@
+import numpy as np
+import traci
+
+from polygon_record import parse_timestep
+
+# Values of the rerouting decision column
+UNDECIDED = -1
+NO_REROUTE = 0
+REROUTE = 1
+
+
+class VehicleStates:
+    def __init__(self, sync_parameters=False, capacity=1024):
+        # Only write the state as vehicle parameters to SUMO when they are needed
+        # (e.g. to inspect them in the GUI)
+        self.sync_parameters = sync_parameters
+
+        self.rows = {}
+        self.free_rows = []
+        self.capacity = 0
+
+        # Zone timesteps are stored as indices into a list of interned timestep strings
+        # and the same timesteps in seconds (-1 for no timestep)
+        self.timesteps = [""]
+        self.timestep_times = [-1]
+        self.timestep_indices = {"": 0}
+
+        self.zone_timestep = np.zeros(0, dtype=np.int32)
+        self.person = np.zeros(
+            0, dtype=np.int32
+        )  # Index of the person in the decision tables
+        self.rerouting_decision = np.zeros(0, dtype=np.int8)
+        self.avoid_polygons = []
+
+        self.__grow(capacity)
+
+    def __contains__(self, vid):
+        return vid in self.rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __grow(self, capacity):
+        n = capacity - self.capacity
+        self.zone_timestep = np.concatenate(
+            [self.zone_timestep, np.zeros(n, dtype=np.int32)]
+        )
+        self.person = np.concatenate([self.person, np.full(n, -1, dtype=np.int32)])
+        self.rerouting_decision = np.concatenate(
+            [self.rerouting_decision, np.full(n, UNDECIDED, dtype=np.int8)]
+        )
+        self.avoid_polygons.extend([None] * n)
+        self.free_rows.extend(range(capacity - 1, self.capacity - 1, -1))
+        self.capacity = capacity
+
+    def add(self, vid, zone_timestep, person=-1):
+        if vid in self.rows:
+            self.remove(vid)
+
+        if len(self.free_rows) == 0:
+            self.__grow(self.capacity * 2)
+
+        row = self.free_rows.pop()
+        self.rows[vid] = row
+
+        if zone_timestep not in self.timestep_indices:
+            self.timestep_indices[zone_timestep] = len(self.timesteps)
+            self.timesteps.append(zone_timestep)
+            self.timestep_times.append(
+                parse_timestep(zone_timestep) if zone_timestep != "" else -1
+            )
+
+        self.zone_timestep[row] = self.timestep_indices[zone_timestep]
+        self.person[row] = person
+        self.rerouting_decision[row] = UNDECIDED
+        self.avoid_polygons[row] = set()
+
+        if self.sync_parameters:
+            traci.vehicle.setParameter(vid, "zone_timestep", zone_timestep)
+
+    def remove(self, vid):
+        if vid not in self.rows:
+            return
+
+        row = self.rows.pop(vid)
+        self.avoid_polygons[row] = None
+        self.free_rows.append(row)
+
+    def get_zone_timestep(self, vid):
+        if vid not in self.rows:
+            return ""
+
+        return self.timesteps[self.zone_timestep[self.rows[vid]]]
+
+    def get_zone_time(self, vid):
+        # Zone timestep of the vehicle in seconds (-1 if unknown)
+        if vid not in self.rows:
+            return -1
+
+        return self.timestep_times[self.zone_timestep[self.rows[vid]]]
+
+    def get_person(self, vid):
+        # Returns -1 if the vehicle or its person is unknown
+        if vid not in self.rows:
+            return -1
+
+        return self.person[self.rows[vid]]
+
+    def get_rerouting_decision(self, vid):
+        # Returns None if the vehicle has not made a decision yet
+        if vid not in self.rows:
+            return None
+
+        decision = self.rerouting_decision[self.rows[vid]]
+        if decision == UNDECIDED:
+            return None
+
+        return decision == REROUTE
+
+    def set_rerouting_decision(self, vid, decision):
+        self.rerouting_decision[self.rows[vid]] = REROUTE if decision else NO_REROUTE
+
+        if self.sync_parameters:
+            traci.vehicle.setParameter(vid, "rerouting_decision", str(decision))
+
+    def is_avoiding_polygon(self, vid, pid):
+        if vid not in self.rows:
+            return False
+
+        return pid in self.avoid_polygons[self.rows[vid]]
+
+    def avoid_polygon(self, vid, pid):
+        polygons = self.avoid_polygons[self.rows[vid]]
+        polygons.add(pid)
+
+        if self.sync_parameters:
+            traci.vehicle.setParameter(vid, "avoid_polygons", ",".join(polygons))
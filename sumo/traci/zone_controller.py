@@ -1,5 +1,7 @@
 import pprint, datetime, os, math
+from concurrent.futures import ThreadPoolExecutor
 import sqlite3
+import numpy as np
 import traci
 from itertools import chain
 import zope.event
@@ -7,18 +9,36 @@ from lxml import etree
 import traci.constants as tc
 from shapely.geometry import Polygon, MultiPolygon, mapping
 from shapely.geometry import box
+from shapely.ops import unary_union
+from shapely.prepared import prep
+from shapely.strtree import STRtree
+from shapely import vectorized
 import geopandas as gpd
 
 from logger import log
+from polygon_record import PolygonRecord, PolygonKind, parse_shape, parse_timestep
 
 import poly_db
 
+# Size of the grid cells (in m) that points are grouped by for the bulk point queries
+grid_cell_size = 500
+
 
 class ZoneController:
     def __init__(self, sim_config):
         self.sim_config = sim_config
         self.current_timestep = ""
+        self.current_time = -1  # Current timestep in seconds
         self.__polygons = {}
+        self.__indices = {}
+        # Edge ids by their index in the polygon database
+        self.__edge_ids = None
+
+        # The polygons of the next timestep are read in a background thread
+        self.__prefetch = None
+        self.__prefetch_executor = None
+        if "prefetchZones" not in self.sim_config or self.sim_config["prefetchZones"]:
+            self.__prefetch_executor = ThreadPoolExecutor(max_workers=1)
 
     def get_polygons(self):
         return list(self.__polygons.values())
@@ -30,27 +50,307 @@ class ZoneController:
         return list(self.__polygons.keys())
 
     def get_polygons_by_timestep(self, timestep=None, holes=True):
+        timestep = timestep or self.current_timestep
+        if timestep in self.__indices:
+            index = self.__indices[timestep]
+            return index["polygons"] if holes else index["zone_polygons"]
+
+        time = parse_timestep(timestep) if timestep != "" else -1
+
         def filter_polygon(polygon):
             if not holes:
-                if polygon["id"].startswith("hole"):
+                if polygon.kind != PolygonKind.ZONE:
                     return False
 
-            p_timestep = polygon["zone_timestep"]
-            return p_timestep == (timestep or self.current_timestep)
+            return polygon.timestep == time
 
         def sort_polygon(polygon):
-            if polygon["id"].startswith("hole"):
+            if polygon.kind != PolygonKind.ZONE:
                 return math.inf
             else:
-                return polygon["zone"]
+                return polygon.zone
 
         polygons = list(filter(filter_polygon, self.__polygons.values()))
         polygons.sort(key=sort_polygon)
 
         return polygons
 
-    def load_polygons_from_file(self):
-        # Load the XML file for the current timestep
+    def build_index(self, timestep):
+        # Build all lookup structures for the polygons of one timestep once per zone update
+        polygons = self.get_polygons_by_timestep(timestep=timestep)
+        zone_polygons = [p for p in polygons if p.kind == PolygonKind.ZONE]
+
+        edge_polygons = {}
+        for p in zone_polygons:
+            for eid in p.edges:
+                if eid in edge_polygons:
+                    edge_polygons[eid].append(p)
+                else:
+                    edge_polygons[eid] = [p]
+
+        # Spatial index over the zone polygons with their holes subtracted
+        resolved = self.resolve_holes(polygons, zone_polygons)
+        geometries = [geometry for _, _, geometry in resolved]
+
+        self.__indices[timestep] = {
+            "polygons": polygons,
+            "zone_polygons": zone_polygons,
+            "resolved": resolved,
+            "bounds": np.array(
+                [geometry.bounds for geometry in geometries], dtype=float
+            ).reshape(-1, 4),
+            "tree": STRtree(geometries) if len(geometries) > 0 else None,
+            # Position of each geometry in the resolved list (the tree returns the geometries)
+            "tree_positions": {
+                id(geometry): i for i, geometry in enumerate(geometries)
+            },
+            # Candidate geometries of each grid cell (see get_cell_candidates)
+            "cells": {},
+            # Position of each zone polygon in the sorted list
+            "order": {p.id: i for i, p in enumerate(zone_polygons)},
+            # All zone polygons (sorted by zone) that cover an edge
+            "edge_polygons": edge_polygons,
+            # All edges that are covered by any zone polygon
+            "edges": frozenset(edge_polygons.keys()),
+            # Penalized travel times for each set of avoided polygons
+            "penalties": {},
+        }
+
+    def resolve_holes(self, polygons, zone_polygons):
+        # SUMO does not support polygons with holes, so they are stored as separate hole polygons
+        # Subtract the holes of each zone from its polygons once so that a point is inside
+        # of at most one resolved geometry (empty holes are zone 0, filled holes are nested zones)
+        holes_by_zone = {}
+        for p in polygons:
+            if p.kind == PolygonKind.ZONE:
+                continue
+
+            if p.zone in holes_by_zone:
+                holes_by_zone[p.zone].append(p.shape)
+            else:
+                holes_by_zone[p.zone] = [p.shape]
+
+        resolved = []
+        for p in zone_polygons:
+            geometry = p.shape
+            if not geometry.is_valid:
+                geometry = geometry.buffer(0)
+
+            holes = [h for h in holes_by_zone.get(p.zone, []) if h.intersects(geometry)]
+            if len(holes) > 0:
+                geometry = geometry.difference(unary_union(holes).buffer(0))
+
+            if geometry.is_empty:
+                continue
+
+            # Prepared geometries speed up the repeated containment queries
+            resolved.append((p, prep(geometry), geometry))
+
+        return resolved
+
+    def get_resolved_polygons(self, timestep=None):
+        # Returns (zone polygon, prepared geometry, geometry) without holes for each zone polygon
+        timestep = timestep or self.current_timestep
+        if timestep not in self.__indices:
+            return []
+
+        return self.__indices[timestep]["resolved"]
+
+    def __query_tree(self, index, geometry):
+        # Returns the positions of all resolved geometries whose bounding box intersects the geometry
+        if index["tree"] is None:
+            return []
+
+        positions = []
+        for result in index["tree"].query(geometry):
+            if isinstance(result, (int, np.integer)):
+                # Newer versions of shapely return the positions directly
+                positions.append(int(result))
+            else:
+                positions.append(index["tree_positions"][id(result)])
+
+        # Keep the order of the zone polygons (sorted by zone)
+        return sorted(positions)
+
+    def get_cell_candidates(self, index, cell):
+        # Positions of the resolved geometries whose bounding box intersects the grid cell
+        # The tree is only queried once for each cell that contains any point
+        if cell not in index["cells"]:
+            x, y = cell
+            area = box(
+                x * grid_cell_size,
+                y * grid_cell_size,
+                (x + 1) * grid_cell_size,
+                (y + 1) * grid_cell_size,
+            )
+            index["cells"][cell] = self.__query_tree(index, area)
+
+        return index["cells"][cell]
+
+    def query_points(self, xs, ys, timestep=None):
+        # Bulk point-in-zone query, e.g. for the positions of all vehicles
+        # Returns the zone polygon that contains the point (or None) for each point
+        hits = [None] * len(xs)
+        timestep = timestep or self.current_timestep
+        if timestep not in self.__indices or len(xs) == 0:
+            return hits
+
+        index = self.__indices[timestep]
+        if index["tree"] is None:
+            return hits
+
+        xs = np.asarray(xs, dtype=float)
+        ys = np.asarray(ys, dtype=float)
+
+        # Group the points by grid cell so that every point is only tested
+        # against the few geometries that are close to its cell
+        cells = np.stack(
+            [
+                np.floor(xs / grid_cell_size).astype(np.int64),
+                np.floor(ys / grid_cell_size).astype(np.int64),
+            ],
+            axis=1,
+        )
+        cells, inverse = np.unique(cells, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        order = np.argsort(inverse, kind="stable")
+        groups = np.split(order, np.flatnonzero(np.diff(inverse[order])) + 1)
+
+        for points in groups:
+            cell = tuple(int(c) for c in cells[inverse[points[0]]])
+            for i in self.get_cell_candidates(index, cell):
+                p, prepared, _ = index["resolved"][i]
+                minx, miny, maxx, maxy = index["bounds"][i]
+                px = xs[points]
+                py = ys[points]
+                candidates = points[
+                    (px >= minx) & (px <= maxx) & (py >= miny) & (py <= maxy)
+                ]
+                if len(candidates) == 0:
+                    continue
+
+                # The resolved geometries don't overlap so every point is inside of at most one of them
+                inside = vectorized.contains(prepared, xs[candidates], ys[candidates])
+                for v in candidates[inside]:
+                    hits[v] = p
+
+        return hits
+
+    def query_lines(self, lines, timestep=None):
+        # Bulk query for linestrings (e.g. route or edge shapes)
+        # Returns all zone polygons (sorted by zone) that intersect the line for each line
+        timestep = timestep or self.current_timestep
+        if timestep not in self.__indices:
+            return [[] for _ in lines]
+
+        index = self.__indices[timestep]
+        results = []
+        for line in lines:
+            polygons = []
+            for i in self.__query_tree(index, line):
+                p, prepared, _ = index["resolved"][i]
+                if prepared.intersects(line):
+                    polygons.append(p)
+            results.append(polygons)
+
+        return results
+
+    def query_bounds(self, bounds, timestep=None):
+        # Returns the candidate zone polygons (sorted by zone) whose bounding box
+        # intersects the given bounds (minx, miny, maxx, maxy)
+        timestep = timestep or self.current_timestep
+        if timestep not in self.__indices:
+            return []
+
+        index = self.__indices[timestep]
+        return [index["resolved"][i][0] for i in self.__query_tree(index, box(*bounds))]
+
+    def get_penalties(self, timestep=None, avoid=None):
+        # Returns the penalized travel times for all zone edges of one timestep
+        # avoid is the list of zone polygon ids that should be avoided (None means all)
+        # The travel times are only calculated once for each set of avoided polygons
+        timestep = timestep or self.current_timestep
+        index = self.__indices[timestep]
+
+        if avoid is not None and len(avoid) == len(index["zone_polygons"]):
+            avoid = None
+        key = None if avoid is None else frozenset(avoid)
+
+        if key not in index["penalties"]:
+            index["penalties"][key] = self.__calculate_penalties(index, key)
+
+        return index["penalties"][key]
+
+    def __calculate_penalties(self, index, avoid):
+        traveltime = 999
+        penalties = {}
+        do_not_avoid = []
+
+        for polygon in index["polygons"]:
+            # Handle holes
+            if polygon.kind != PolygonKind.ZONE:
+                if polygon.kind == PolygonKind.EMPTY_HOLE:
+                    do_not_avoid.append(polygon)
+
+                continue
+
+            # Handle regular zone polygons
+            if avoid is None or polygon.id in avoid:
+                for eid in polygon.edges:
+                    # Set travel times for all edges to very high value
+                    # More polluted zones get a higher traveltime
+                    penalties[eid] = float(traveltime * (polygon.zone ** 2))
+            else:
+                do_not_avoid.append(polygon)
+
+        for polygon in do_not_avoid:
+            # Make sure holes and other polygons that should not be avoided have 0 traveltime
+            # Do this step separately after the loop above because SUMO can't deal with polygons that have holes
+            # This basically partially overwrites some weights set above because polygons are layered
+            for eid in polygon.edges:
+                penalties[eid] = 0
+
+        return penalties
+
+    def get_edge_polygons(self, eid, timestep=None):
+        # Returns all zone polygons (sorted by zone) that cover the given edge
+        timestep = timestep or self.current_timestep
+        if timestep not in self.__indices:
+            return []
+
+        index = self.__indices[timestep]
+        return index["edge_polygons"].get(eid, [])
+
+    def get_route_intersections(self, edges, timestep=None):
+        # Returns all zone polygons (sorted by zone) that the given edges pass through
+        # together with the edges of the route that are inside of each polygon
+        timestep = timestep or self.current_timestep
+        if timestep not in self.__indices:
+            return []
+
+        index = self.__indices[timestep]
+        if index["edges"].isdisjoint(edges):
+            return []
+
+        edge_polygons = index["edge_polygons"]
+        intersections = {}
+        for eid in edges:
+            if eid not in edge_polygons:
+                continue
+
+            for p in edge_polygons[eid]:
+                pid = p.id
+                if pid in intersections:
+                    intersections[pid][1].add(eid)
+                else:
+                    intersections[pid] = (p, {eid})
+
+        order = index["order"]
+        return sorted(intersections.values(), key=lambda i: order[i[0].id])
+
+    def read_polygons_from_file(self, timestep):
+        # Parse the XML file of the timestep
+        # Doesn't use TraCI so that it can run in the background
         pad = lambda n: f"0{n}" if n < 10 else n
         date_parts = list(
             map(
@@ -59,101 +359,193 @@ class ZoneController:
         )
         date_string = "-".join(date_parts[::-1])
 
-        zone_file = f"zones_{date_string}T{self.current_timestep}.xml"
+        zone_file = f"zones_{date_string}T{timestep}.xml"
         # zone_file = f"zones_{date_string}T10-00-00.xml"
-        log(f"Loading {zone_file} file")
-
         file_path = os.path.join(self.sim_config["sim_airDataDir"], zone_file)
 
-        # Traverse the XML tree and add all new polygons
-        log(f"Adding new polygons for timestep {self.current_timestep}")
+        records = []
         for event, poly in etree.iterparse(file_path, tag="poly"):
-            pid = f"{poly.attrib['id']}_{self.current_timestep}"
-            shape = list(
-                map(
-                    lambda pair: tuple(map(float, pair.split(","))),
-                    poly.attrib["shape"].split(" "),
-                )
-            )
+            pid = f"{poly.attrib['id']}_{timestep}"
+            coordinates = parse_shape(poly.attrib["shape"])
             zone = int(pid.split("_")[0].split("-")[-2])
             ptype = poly.attrib["type"]
             color = list(map(int, poly.attrib["color"].split(",")))
             layer = int(float(poly.attrib["layer"]))
 
-            traci.polygon.add(
-                pid, shape, color, fill=True, layer=layer, polygonType=ptype
+            # Edges are found after the polygon has been added to SUMO
+            polygon = PolygonRecord(
+                pid,
+                zone,
+                timestep,
+                ptype,
+                Polygon(coordinates),
+                hash(coordinates.tobytes()),
             )
-
-            polygon = {
-                "id": pid,
-                "zone": zone,
-                "zone_timestep": self.current_timestep,
-                "type": ptype,
-                "shape": Polygon(shape),
-                "edges": [],
-            }
-
-            # Calculate and store all edges that are covered by each new polygon
-            # Add temporary subscription to be able to query for all edges
-            # Get all edges for polygon pid that are within distance of 0
-            traci.polygon.subscribeContext(
-                pid, tc.CMD_GET_EDGE_VARIABLE, 0, [tc.ID_COUNT]
+            records.append((polygon, coordinates.tolist(), color, layer))
+            poly.clear()
+
+        return records
+
+    def read_polygons_from_db(self, timestep, connection=None):
+        # Query and parse the polygons of the timestep from the database
+        # Doesn't use TraCI so that it can run in the background (with its own connection)
+        if self.__edge_ids is None:
+            self.__edge_ids = poly_db.get_edge_ids(connection=connection)
+
+        records = []
+        for row in poly_db.get_all_from_timestep(timestep, connection=connection):
+            pid = f"{row['id']}_{timestep}"
+            # The shape is stored as binary coordinates that don't need to be parsed
+            coordinates = poly_db.unpack_shape(row["shape"])
+            color = list(map(int, row["color"].split(",")))
+            edges = self.__edge_ids[row["edges"]]
+
+            polygon = PolygonRecord(
+                pid,
+                int(row["zone"]),
+                timestep,
+                row["type"],
+                Polygon(coordinates),
+                hash(row["shape"]),
+                edges=edges,
             )
-            polygon_context = traci.polygon.getContextSubscriptionResults(pid)
-            # Remove context subscription because we don't need it anymore
-            traci.polygon.unsubscribeContext(pid, tc.CMD_GET_EDGE_VARIABLE, 0)
+            records.append((polygon, coordinates.tolist(), color, row["layer"]))
 
-            if polygon_context is None:
-                log(
-                    f"Polygon {pid} will be removed because it is not covering any edges."
-                )
-                # Edges subscription can be None when the polygon doesn't cover any edges
-                # Since it doesn't cover any edges it can be removed
-                traci.polygon.remove(pid)
+        return records
+
+    def read_polygons(self, timestep, background=False):
+        if self.sim_config["sim_polygonDatabase"] is not None:
+            if not background:
+                return self.read_polygons_from_db(timestep)
+
+            # SQLite connections can only be used in the thread that created them
+            connection = poly_db.open_connection()
+            try:
+                return self.read_polygons_from_db(timestep, connection=connection)
+            finally:
+                connection.close()
+
+        return self.read_polygons_from_file(timestep)
+
+    def prefetch_polygons(self, timestep):
+        # Read the polygons of the next timestep in the background while the simulation continues
+        self.__prefetch = (
+            timestep,
+            self.__prefetch_executor.submit(self.read_polygons, timestep, True),
+        )
+
+    def finish(self):
+        if self.__prefetch_executor is not None:
+            self.__prefetch = None
+            self.__prefetch_executor.shutdown(wait=True)
+
+    def get_prefetched_polygons(self, timestep):
+        # Returns None if the polygons of the timestep have not been prefetched
+        if self.__prefetch is None:
+            return None
+
+        prefetch_timestep, future = self.__prefetch
+        self.__prefetch = None
+        if prefetch_timestep != timestep:
+            future.cancel()
+            return None
+
+        try:
+            return future.result()
+        except Exception as e:
+            log(f"Prefetching polygons for timestep {timestep} failed: {e}")
+            return None
+
+    def diff_polygons(self, previous_polygons, records):
+        # Match the new polygons to the polygons of the previous timestep by their geometry
+        # Polygons with the same geometry keep their edges so that they don't have to be looked up again
+        previous_by_hash = {}
+        for p in previous_polygons:
+            if p.geometry_hash in previous_by_hash:
+                previous_by_hash[p.geometry_hash].append(p)
+            else:
+                previous_by_hash[p.geometry_hash] = [p]
+
+        delta = {"added": [], "removed": [], "changed": [], "unchanged": []}
+        for polygon, _, _, _ in records:
+            candidates = previous_by_hash.get(polygon.geometry_hash, [])
+            if len(candidates) == 0:
+                delta["added"].append(polygon.id)
                 continue
 
-            edges = list(polygon_context.keys())
-            log(f"Found {len(edges)} edges in polygon {pid}")
-            polygon["edges"] = edges
+            # Prefer a previous polygon of the same zone level
+            same = [
+                p
+                for p in candidates
+                if p.zone == polygon.zone and p.type == polygon.type
+            ]
+            previous = same[0] if len(same) > 0 else candidates[0]
+            candidates.remove(previous)
 
-            self.__polygons[pid] = polygon
+            if polygon.edges is None:
+                polygon.edges = previous.edges
 
-    def load_polygons_from_db(self):
-        log(f"Querying polygons for timestep {self.current_timestep} from database")
-        polygons = poly_db.get_all_from_timestep(self.current_timestep)
-        log(f"Adding new polygons for timestep {self.current_timestep}")
-        for polygon in polygons:
-            pid = f"{polygon['id']}_{self.current_timestep}"
-            zone = int(polygon["zone"])
-            ptype = polygon["type"]
-            shape = list(
-                map(
-                    lambda pair: tuple(map(float, pair.split(","))),
-                    polygon["shape"].split(" "),
-                )
-            )
-            layer = polygon["layer"]
-            color = list(map(int, polygon["color"].split(",")))
-            edges = polygon["edges"].split(" ") if polygon["edges"] != "" else None
+            if len(same) > 0:
+                delta["unchanged"].append((previous.id, polygon.id))
+            else:
+                delta["changed"].append((previous.id, polygon.id))
+
+        for candidates in previous_by_hash.values():
+            delta["removed"].extend(p.id for p in candidates)
+
+        return delta
+
+    def get_delta_edges(self, delta):
+        # All edges whose zone has changed between the two timesteps
+        pids = list(delta["added"]) + list(delta["removed"])
+        for previous_pid, pid in delta["changed"]:
+            pids.extend([previous_pid, pid])
+
+        edges = set()
+        for pid in pids:
+            # Polygons without any edges have never been added
+            if pid in self.__polygons:
+                edges.update(self.__polygons[pid].edges)
+
+        return frozenset(edges)
 
-            if edges is None:
+    def add_polygons(self, records):
+        log(f"Adding new polygons for timestep {self.current_timestep}")
+        for polygon, shape, color, layer in records:
+            pid = polygon.id
+            if polygon.edges is not None and len(polygon.edges) == 0:
                 log(
                     f"Polygon {pid} will not be added because it is not covering any edges."
                 )
                 continue
 
             traci.polygon.add(
-                pid, shape, color, fill=True, layer=layer, polygonType=ptype
+                pid, shape, color, fill=True, layer=layer, polygonType=polygon.type
             )
 
-            polygon = {
-                "id": pid,
-                "zone": zone,
-                "zone_timestep": self.current_timestep,
-                "type": ptype,
-                "shape": Polygon(shape),
-                "edges": edges,
-            }
+            if polygon.edges is None:
+                # Calculate and store all edges that are covered by each new polygon
+                # Add temporary subscription to be able to query for all edges
+                # Get all edges for polygon pid that are within distance of 0
+                traci.polygon.subscribeContext(
+                    pid, tc.CMD_GET_EDGE_VARIABLE, 0, [tc.ID_COUNT]
+                )
+                polygon_context = traci.polygon.getContextSubscriptionResults(pid)
+                # Remove context subscription because we don't need it anymore
+                traci.polygon.unsubscribeContext(pid, tc.CMD_GET_EDGE_VARIABLE, 0)
+
+                if polygon_context is None:
+                    log(
+                        f"Polygon {pid} will be removed because it is not covering any edges."
+                    )
+                    # Edges subscription can be None when the polygon doesn't cover any edges
+                    # Since it doesn't cover any edges it can be removed
+                    traci.polygon.remove(pid)
+                    continue
+
+                edges = list(polygon_context.keys())
+                log(f"Found {len(edges)} edges in polygon {pid}")
+                polygon.set_edges(edges)
 
             self.__polygons[pid] = polygon
 
@@ -164,10 +556,13 @@ class ZoneController:
         timestep = self.get_timestep_from_step(t)
         log(f"Removing polygons from timestep {timestep}")
         for p in self.get_polygons_by_timestep(timestep=timestep):
-            pid = p["id"]
+            pid = p.id
             traci.polygon.remove(pid)
             del self.__polygons[pid]
 
+        if timestep in self.__indices:
+            del self.__indices[timestep]
+
     def hide_polygons(self, t):
         if t < 0:
             return
@@ -175,7 +570,7 @@ class ZoneController:
         timestep = self.get_timestep_from_step(t)
         log(f"Hiding polygons from timestep {timestep}")
         for p in self.get_polygons_by_timestep(timestep=timestep):
-            traci.polygon.setFilled(p["id"], False)
+            traci.polygon.setFilled(p.id, False)
 
     def get_timestep_from_step(self, t):
         pad = lambda n: f"0{n}" if n < 10 else n
@@ -187,19 +582,46 @@ class ZoneController:
         log("New timestep! Zones will be updated...")
         interval = self.sim_config["zoneUpdateInterval"] * 60
         timestep = self.get_timestep_from_step(step)
+        previous_timestep = self.current_timestep
         self.current_timestep = timestep
+        self.current_time = parse_timestep(timestep)
         # Always keep the polygons up until three hours after they have been loaded
         keep_duration = 2 * 60 * 60
         self.remove_polygons(step - keep_duration)
         # Hide the polygons from last timestep
         self.hide_polygons(step - interval)
 
-        if self.sim_config["sim_polygonDatabase"] is not None:
-            self.load_polygons_from_db()
+        records = self.get_prefetched_polygons(timestep)
+        if records is not None:
+            log(f"Using prefetched polygons for timestep {timestep}")
         else:
-            self.load_polygons_from_file()
+            if self.sim_config["sim_polygonDatabase"] is not None:
+                log(f"Querying polygons for timestep {timestep} from database")
+            else:
+                log(f"Loading zone file for timestep {timestep}")
+            records = self.read_polygons(timestep)
+
+        # Only look at the differences to the previous timestep
+        previous_polygons = []
+        if previous_timestep in self.__indices:
+            previous_polygons = self.__indices[previous_timestep]["polygons"]
+        delta = self.diff_polygons(previous_polygons, records)
+
+        self.add_polygons(records)
+        self.build_index(timestep)
+
+        delta["previous_timestep"] = previous_timestep
+        delta["edges"] = self.get_delta_edges(delta)
+        log(
+            f"Zone delta: {len(delta['added'])} added, {len(delta['removed'])} removed, "
+            f"{len(delta['changed'])} changed, {len(delta['unchanged'])} unchanged polygons "
+            f"({len(delta['edges'])} edges)"
+        )
+
+        if self.__prefetch_executor is not None:
+            self.prefetch_polygons(self.get_timestep_from_step(step + interval))
 
         log("Done\n")
 
-        # Notify subscribers about the zone update
-        zope.event.notify("zone-update")
+        # Notify subscribers about the zone update and what has changed
+        zope.event.notify({"name": "zone-update", "timestep": timestep, "delta": delta})